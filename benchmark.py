@@ -0,0 +1,99 @@
+import argparse
+import json
+import pathlib
+import sys
+
+import includes.benchmark as bench
+import includes.prepare as prep
+from settings import conf  # Import configuration defined in settings.py
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Measure each stage of the data preparation and plotting on synthetic data."
+    )
+    parser.add_argument(
+        '--regions', type=int, default=1500, help="number of NUTS regions"
+    )
+    parser.add_argument('--days', type=int, default=880, help="number of days")
+    parser.add_argument(
+        '--gap-rate', type=float, default=0.1, help="share of rows missing"
+    )
+    parser.add_argument(
+        '--outlier-rate', type=float, default=0.001, help="share of outliers"
+    )
+    parser.add_argument(
+        '--frames', type=int, default=5, help="frames measured per frame stage"
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=1, help="runs per stage (best is used)"
+    )
+    parser.add_argument(
+        '--baseline', help="results of an earlier run (JSON) to compare to"
+    )
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.2,
+        help="slowdown reported as regression (0.2 = 20%%)",
+    )
+    parser.add_argument(
+        '--memory',
+        action='store_true',
+        help="measure the peak memory of the data update instead",
+    )
+    parser.add_argument(
+        '--missing-dates',
+        action='store_true',
+        help="compare transform_missing_dates to its previous implementation instead",
+    )
+    args = parser.parse_args()
+
+    if args.missing_dates:
+        benchmark_missing_dates()
+        return
+
+    if args.memory:
+        bench.benchmark_memory(
+            args.regions, args.days, args.gap_rate, args.outlier_rate
+        )
+        return
+
+    report = bench.benchmark_suite(
+        regions=args.regions,
+        days=args.days,
+        gap_rate=args.gap_rate,
+        outlier_rate=args.outlier_rate,
+        frames=args.frames,
+        repeat=args.repeat,
+    )
+
+    # Compare to a baseline, failing if a stage got slower
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+        if bench.benchmark_compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+def benchmark_missing_dates():
+
+    # Use the local copy of the tracker data if available, otherwise synthetic data
+    if pathlib.Path(conf['source_file']).exists():
+        covid_clean = prep.clean_data(prep.import_data())
+        label = 'tracker data'
+    else:
+        print("No tracker data found in data/. Using synthetic data instead.")
+        covid_clean = bench.synthetic_tracker()
+        label = 'synthetic data'
+
+    # Benchmark data preparation on the data and on a dataset with ten times the regions
+    bench.benchmark_missing_dates(covid_clean, label)
+    bench.benchmark_missing_dates(bench.scale_regions(covid_clean, 10), label + ' x 10')
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,96 @@
+import PIL.GifImagePlugin as GifImagePlugin
+import PIL.Image as Image
+
+
+#
+# Image made of a sequence of frames that are only loaded when the encoder seeks to them
+# Pillow's WebP encoder takes all frames as one image with several frames, so only the current
+# frame (and the first one, which the encoder seeks to again at the end) is kept in memory.
+#
+class FrameSequence(Image.Image):
+    def __init__(self, frames, n_frames):
+
+        super().__init__()
+
+        self.frames = iter(frames)
+        self.n_frames = n_frames
+        self.is_animated = n_frames > 1
+        self.frame_index = -1
+
+        self.first = next(self.frames)
+        self.seek(0)
+
+    def seek(self, frame):
+
+        if frame == 0:
+            image = self.first
+        elif frame == self.frame_index + 1:
+            image = next(self.frames)
+        else:
+            raise EOFError("Frames can only be read in order.")
+
+        self.im = image.im
+        self._size = image.size
+
+        # Pillow < 10.1 stores the mode as attribute, later versions as property of _mode
+        if isinstance(getattr(type(self), 'mode', None), property):
+            self._mode = image.mode
+        else:
+            self.mode = image.mode
+
+        self.frame_index = frame
+
+    def tell(self):
+
+        return self.frame_index
+
+
+#
+# Function to load images from files one at a time, closing each file after reading it
+#
+def file_frames(file_list):
+
+    for file in file_list:
+        with Image.open(file) as image:
+            yield image.convert('RGB')
+
+
+#
+# Function to write an animated GIF, encoding and writing one frame at a time
+#
+def write_gif(anim_path, frames, duration, loop):
+
+    with open(anim_path, 'wb') as file:
+        for i, frame in enumerate(frames):
+
+            # Reduce each frame to its own palette of 256 colors
+            frame = frame.convert('RGB').convert('P', palette=Image.Palette.ADAPTIVE)
+
+            if i == 0:
+                header, _ = GifImagePlugin.getheader(frame, info={'loop': loop})
+                file.write(b''.join(header))
+
+            for data in GifImagePlugin.getdata(
+                frame, duration=duration, include_color_table=True
+            ):
+                file.write(data)
+
+        # GIF trailer
+        file.write(b';')
+
+
+#
+# Function to write an animated WebP, loading one frame at a time
+#
+def write_webp(anim_path, frames, n_frames, duration, loop):
+
+    FrameSequence(frames, n_frames).save(
+        anim_path,
+        format='webp',
+        save_all=True,
+        duration=duration,
+        loop=loop,
+        optimize=False,
+        disposal=2,
+        lossless=True,
+    )
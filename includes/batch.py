@@ -0,0 +1,152 @@
+import concurrent.futures as cf
+import contextlib
+import pathlib
+
+import includes.plot as plot
+from settings import conf  # Import configuration defined in settings.py
+
+
+#
+# Function to render all jobs of a batch (conf['jobs']) in one run
+# The data is imported once per data file, and the geometry and break points are prepared once for all
+# jobs needing them. Jobs are distributed to conf['workers'] processes, each job rendering its images
+# serially. All output goes to export/batch/<date and time>/<metric>/<job>/.
+#
+def batch_run(jobs, filepath_dt):
+
+    batch_path = pathlib.Path('export/batch/' + filepath_dt.strftime('%Y%m%d-%H%M%S'))
+    jobs = [batch_job(job) for job in jobs]
+
+    print(f"\nStarting batch of {len(jobs)} jobs.")
+
+    # Import each data file once with all metrics needed by the jobs
+    data = {}
+    for job in jobs:
+        data.setdefault(plot.data_file(job['metric']), []).append(job['metric'])
+
+    data = {
+        file: plot.import_covid_data(list(dict.fromkeys(metrics)))[1]
+        for file, metrics in data.items()
+    }
+
+    # Prepare the geometry caches and the break points in this process, so the jobs only load them
+    for job in jobs:
+        with job_conf(job):
+            df, df_raw = batch_data(data)
+            _, nuts_ids, _ = plot.frames_matrix(df)
+            plot.import_geojson(nuts_ids, simplify=True)
+            plot.plot_breaks(df, df_raw)
+
+    workers = min(conf['workers'], len(jobs))
+    dates_processed = 0
+
+    if workers > 1:
+        print(f"\nRendering {len(jobs)} jobs using {workers} worker processes.")
+
+        with cf.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=batch_worker_init,
+            initargs=(data, plot.breaks_cache, conf),
+        ) as executor:
+            futures = [
+                executor.submit(batch_worker, job, filepath_dt, batch_path)
+                for job in jobs
+            ]
+
+            for future in cf.as_completed(futures):
+                dates_processed += future.result()
+
+    else:
+        batch_worker_init(data, plot.breaks_cache, conf)
+
+        for job in jobs:
+            dates_processed += batch_worker(job, filepath_dt, batch_path)
+
+    print(f"\nBatch done. Output saved to {batch_path}")
+
+    return dates_processed
+
+
+#
+# Function to get the settings of a job (e.g. metric, resolution, width, image_format)
+# Each job renders its images serially, as the jobs are rendered in parallel. The height follows
+# the width (using height_scale) unless set for the job.
+#
+def batch_job(job):
+
+    job = {**job, 'workers': 1, 'resumable': False, 'resume_path': ''}
+
+    if 'width' in job and 'height' not in job:
+        job['height'] = job['width'] * conf['height_scale']
+
+    return {'metric': conf['metric'], **job}
+
+
+#
+# Context manager to temporarily apply the settings of a job to the configuration
+#
+@contextlib.contextmanager
+def job_conf(job):
+
+    previous = {key: conf[key] for key in job if key in conf}
+    conf.update(job)
+
+    try:
+        yield
+    finally:
+        for key in job:
+            if key in previous:
+                conf[key] = previous[key]
+            else:
+                del conf[key]
+
+
+#
+# Function to get the data of the current job from the imported data files
+#
+def batch_data(data):
+
+    df_raw = data[plot.data_file(conf['metric'])]
+
+    # If set, reduce data set to requested time frame
+    df = df_raw
+    if conf['set_dates']:
+        df = df[(df['date'] >= conf['date_start']) & (df['date'] <= conf['date_end'])]
+
+    return df, df_raw
+
+
+# Data imported by batch_run(), set by batch_worker_init()
+worker_data = {}
+
+
+#
+# Function to initialize a process rendering jobs of a batch
+#
+def batch_worker_init(data, breaks, config):
+
+    # Use the configuration of the parent process (e.g. calculated height)
+    conf.update(config)
+
+    worker_data.update(data)
+    plot.breaks_cache.update(breaks)
+
+
+#
+# Function to render the images and the animation of a job
+#
+def batch_worker(job, filepath_dt, batch_path):
+
+    with job_conf(job):
+        job_path = (
+            batch_path
+            / conf['metric']
+            / f"{conf['resolution']}-{conf['width']}px-{conf['image_format']}"
+        )
+        job_path.mkdir(parents=True, exist_ok=True)
+
+        print(f"\nStarting job {job_path}.")
+
+        df, df_raw = batch_data(worker_data)
+
+        return plot.plot_images(df, df_raw, filepath_dt, job_path=job_path)
@@ -0,0 +1,581 @@
+import contextlib
+import datetime as dt
+import io
+import json
+import math
+import pathlib
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import includes.batch as batch
+import includes.misc as misc
+import includes.player as player
+import includes.plot as plot
+import includes.prepare as prep
+import includes.raster as raster
+import includes.render as render
+
+# Folder for the results of the benchmark suite
+RESULTS_PATH = 'export/benchmark'
+
+
+#
+# Function to create a synthetic dataset in the format of the imported tracker data
+# A share of the rows is removed as gaps, and a share of the values is multiplied as outliers.
+# The columns get the types of imported data (see prep.schema_apply()).
+#
+def synthetic_tracker(regions=1500, days=880, gap_rate=0.1, outlier_rate=0.001, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    dates = pd.date_range('2020-02-01', periods=days, freq='D')
+    nuts_ids = np.array([f'XX{i:04d}' for i in range(regions)])
+
+    # One row per region and date, with a share of the rows removed as gaps
+    nuts_col = np.repeat(nuts_ids, days)
+    date_col = np.tile(dates, regions)
+    population = np.repeat(rng.integers(20_000, 2_000_000, regions), days)
+    cases = rng.gamma(1.5, 20, regions * days).round()
+    cases[rng.random(regions * days) < outlier_rate] *= 100
+    keep = rng.random(regions * days) >= gap_rate
+
+    covid_raw = pd.DataFrame(
+        {
+            'country': pd.Series(nuts_col).str[:2],
+            'nuts_id': nuts_col,
+            'nuts_name': 'Region ' + pd.Series(nuts_col),
+            'date': date_col,
+            'population': population.astype(float),
+            'cases': cases,
+        }
+    )
+
+    return prep.schema_apply(covid_raw[keep].reset_index(drop=True))
+
+
+#
+# Function to create synthetic GeoJSON files for the NUTS regions (a grid of squares over Europe,
+# each with points_per_side points per side) and their country, in the format of the Eurostat files
+#
+def synthetic_geojson(nuts_ids, nuts_file, countries_file, points_per_side=10):
+
+    columns = math.ceil(math.sqrt(len(nuts_ids)))
+    size = 40 / columns
+    steps = np.linspace(0, 1, points_per_side, endpoint=False)
+
+    def square(lon, lat, width, height):
+        ring = np.concatenate(
+            [
+                np.c_[lon + steps * width, np.full(points_per_side, lat)],
+                np.c_[np.full(points_per_side, lon + width), lat + steps * height],
+                np.c_[
+                    lon + width - steps * width, np.full(points_per_side, lat + height)
+                ],
+                np.c_[np.full(points_per_side, lon), lat + height - steps * height],
+                [[lon, lat]],
+            ]
+        )
+        return {'type': 'Polygon', 'coordinates': [ring.round(6).tolist()]}
+
+    nuts = {
+        'type': 'FeatureCollection',
+        'features': [
+            {
+                'type': 'Feature',
+                'id': nuts_id,
+                'properties': {'NUTS_ID': nuts_id, 'LEVL_CODE': 3},
+                'geometry': square(
+                    -10 + (i % columns) * size,
+                    35 + (i // columns) * size * 0.8,
+                    size,
+                    size * 0.8,
+                ),
+            }
+            for i, nuts_id in enumerate(nuts_ids)
+        ],
+    }
+
+    countries = {
+        'type': 'FeatureCollection',
+        'features': [
+            {
+                'type': 'Feature',
+                'id': 'XX',
+                'properties': {'CNTR_ID': 'XX'},
+                'geometry': square(-10, 35, 40, 32),
+            }
+        ],
+    }
+
+    for geojson, file_name in [(nuts, nuts_file), (countries, countries_file)]:
+        with open(file_name, 'w') as file:
+            json.dump(geojson, file)
+
+
+#
+# Function to enlarge a dataset by copying its regions under new NUTS ids
+#
+def scale_regions(covid_raw, factor):
+
+    copies = []
+
+    for i in range(factor):
+        copy = covid_raw.copy()
+        copy['nuts_id'] = copy['nuts_id'].astype(str) + ('' if i == 0 else f'-{i}')
+        copies.append(copy)
+
+    return prep.schema_apply(pd.concat(copies, ignore_index=True))
+
+
+#
+# Function to measure the running time of a function (best of several runs)
+#
+def time_function(function, *args, repeat=1, quiet=False):
+
+    durations = []
+
+    for _ in range(repeat):
+        # Copy arguments, since some functions work on their input
+        args_copy = [
+            arg.copy() if isinstance(arg, pd.DataFrame) else arg for arg in args
+        ]
+
+        with contextlib.redirect_stdout(io.StringIO() if quiet else sys.stdout):
+            time_start = time.perf_counter()
+            result = function(*args_copy)
+            durations.append(time.perf_counter() - time_start)
+
+    return min(durations), result
+
+
+#
+# Function to measure a stage of the benchmark, adding its running time to the results
+#
+def time_stage(results, name, function, *args, repeat=1):
+
+    duration, result = time_function(function, *args, repeat=repeat, quiet=True)
+    results[name] = duration
+
+    print(f"{name:<32} {duration:>10.4f} s")
+
+    return result
+
+
+#
+# Function to measure the running time per frame of a function called for several frames (mean)
+#
+def time_frames(results, name, function, frames):
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        time_start = time.perf_counter()
+        for index in range(frames):
+            function(index)
+        duration = (time.perf_counter() - time_start) / frames
+
+    results[name] = duration
+
+    print(f"{name:<32} {duration:>10.4f} s per frame")
+
+
+#
+# Previous implementation of prep.transform_missing_dates (one reindex per nuts_id group)
+#
+def reference_missing_dates(covid_calc):
+
+    date_min = covid_calc['date'].min()
+    date_max = covid_calc['date'].max()
+    dates = pd.date_range(date_min, date_max, freq='D', name='date')
+
+    # Newer pandas versions leave the grouping column out in apply(), so each group is reindexed
+    # and gets its NUTS id back
+    groups = [
+        group.set_index('date').reindex(dates).assign(nuts_id=nuts_id)
+        for nuts_id, group in covid_calc.groupby('nuts_id', observed=True)
+    ]
+
+    result = pd.concat(groups).reset_index()
+    result['nuts_id'] = result['nuts_id'].astype(covid_calc['nuts_id'].dtype)
+    columns = ['nuts_id', 'date', *covid_calc.columns.drop(['nuts_id', 'date'])]
+
+    return result[columns]
+
+
+#
+# Function to compare prep.transform_missing_dates to the previous implementation
+#
+def benchmark_missing_dates(covid_clean, label):
+
+    time_reference, result_reference = time_function(
+        reference_missing_dates, covid_clean
+    )
+    time_current, result_current = time_function(
+        prep.transform_missing_dates, covid_clean
+    )
+
+    # Make sure the results are the same
+    pd.testing.assert_frame_equal(result_current, result_reference)
+
+    print(
+        f"\ntransform_missing_dates ({label}, {len(covid_clean)} rows): "
+        f"{round(time_reference, 2)} s before, {round(time_current, 2)} s now "
+        f"({round(time_reference / time_current, 1)}x faster)"
+    )
+
+    return time_reference, time_current
+
+
+#
+# Function to measure the data preparation: clean_data and each step of transform_data
+#
+def benchmark_prepare(covid_raw, results, repeat=1):
+
+    covid_clean = time_stage(
+        results, 'clean_data', prep.clean_data, covid_raw, repeat=repeat
+    )
+
+    covid_calc = covid_clean
+    for name in [
+        'transform_missing_dates',
+        'transform_fill_missing',
+        'transform_interpolate',
+        'transform_calc_pop',
+    ]:
+        covid_calc = time_stage(
+            results, name, getattr(prep, name), covid_calc, repeat=repeat
+        )
+
+    covid_calc_weekly = time_stage(
+        results,
+        'transform_fork_weekly',
+        prep.transform_fork_weekly,
+        covid_calc,
+        repeat=repeat,
+    )
+
+    for period in ['daily', 'weekly']:
+        data = covid_calc if period == 'daily' else covid_calc_weekly
+
+        data = time_stage(
+            results,
+            f'transform_rolling_{period}',
+            lambda df: prep.transform_rolling(df, period=period),
+            data,
+            repeat=repeat,
+        )
+        data = time_stage(
+            results,
+            f'transform_fill_no_data_{period}',
+            lambda df: prep.transform_fill_no_data(df, period=period),
+            data,
+            repeat=repeat,
+        )
+
+        if period == 'daily':
+            covid_calc = data
+
+    return covid_calc
+
+
+#
+# Function to measure the plotting: break points, per-frame slice, figure update and image export
+# The maps use synthetic GeoJSON files for the NUTS regions of the data (geometry caches in a temporary folder).
+#
+def benchmark_plot(covid_calc, results, frames=5, repeat=1):
+
+    metric = 'moving14d_pop'
+    df = covid_calc[['country', 'nuts_id', 'nuts_name', 'date', metric]]
+
+    # Geometry, frames and cache used by the benchmark only
+    overrides = {
+        'metric': metric,
+        'frame_cache_size': 0,
+        'render_engine': 'kaleido',
+        'resolution': 'synthetic',
+        'width': 1000,
+        'height': 750,
+    }
+
+    with batch.job_conf(overrides), tempfile.TemporaryDirectory() as temp_path:
+        geojson_file = temp_path + '/{kind}_RG_{resolution}.geojson'
+        cache_path = temp_path + '/cache'
+
+        synthetic_geojson(
+            df['nuts_id'].unique(),
+            geojson_file.format(kind='NUTS', resolution='synthetic'),
+            geojson_file.format(kind='CNTR', resolution='synthetic'),
+        )
+
+        def breaks(df_breaks):
+            plot.breaks_cache.clear()
+            return plot.plot_breaks(df_breaks, df_breaks)
+
+        time_stage(results, 'plot_breaks', breaks, df, repeat=repeat)
+        dates, nuts_ids, values = time_stage(
+            results, 'frames_matrix', plot.frames_matrix, df, repeat=repeat
+        )
+        frames = min(frames, len(dates))
+
+        # Selecting the values of a frame as it was done before the matrix, and as it is done now
+        time_frames(
+            results,
+            'frame_slice_dataframe',
+            lambda index: df[df['date'] == dates[index]].set_index('nuts_id')[metric],
+            frames,
+        )
+        time_frames(results, 'frame_slice', lambda index: values[index], frames)
+
+        fig = time_stage(
+            results,
+            'base_figure',
+            plot.plot_base_figure,
+            df,
+            df,
+            nuts_ids,
+            values[0],
+            True,
+            geojson_file,
+            cache_path,
+        )
+        template = render.frame_template(fig)
+        date_range = (df['date'].min(), df['date'].max())
+
+        def figure_json(index):
+            return render.frame_json(
+                template,
+                z=values[index],
+                date_text=plot.date_text(dates[index]),
+                date_y=plot.date_y(dates[index], date_range),
+            )
+
+        time_frames(results, 'figure_update', figure_json, frames)
+
+        # Frames of the chunked HTML export, in monthly and weekly files
+        breaks, _, zmax = plot.plot_breaks(df, df)
+
+        for freq in ['M', 'W']:
+            chunks = time_stage(
+                results,
+                'html_chunks_' + freq,
+                player.player_files,
+                temp_path + '/html-' + freq,
+                values,
+                dates,
+                breaks,
+                zmax,
+                'float32',
+                freq,
+                repeat=repeat,
+            )
+            check_chunks(temp_path + '/html-' + freq, chunks, values)
+
+        # Image export (Kaleido and native renderer), skipped if Kaleido isn't available
+        try:
+            image_file = temp_path + '/frame.png'
+
+            def export_kaleido(index):
+                with open(image_file, 'wb') as file:
+                    file.write(
+                        render.render_frame(figure_json(index), 'png', 1000, 750)
+                    )
+
+            # Start Kaleido before measuring
+            export_kaleido(0)
+            time_frames(results, 'image_export', export_kaleido, frames)
+
+            layers = time_stage(
+                results,
+                'native_layers',
+                raster.frame_layers,
+                fig,
+                [plot.date_text(date) for date in dates],
+            )
+
+            def export_native(index):
+                frame = raster.frame_image(
+                    layers, values[index], index, plot.date_y(dates[index], date_range)
+                )
+                raster.write_frame(frame, image_file, 'png')
+
+            time_frames(results, 'image_export_native', export_native, frames)
+
+        except Exception as error:
+            print(f"Image export skipped: {error}")
+
+
+#
+# Function to check that the chunks of the chunked HTML export contain all frames in order
+#
+def check_chunks(export_path, chunks, values):
+
+    data = b''.join(
+        (pathlib.Path(export_path) / chunk['file']).read_bytes() for chunk in chunks
+    )
+
+    assert data == np.ascontiguousarray(values.astype('<f4')).tobytes()
+    assert [chunk['start'] for chunk in chunks] == sorted(
+        {chunk['start'] for chunk in chunks}
+    )
+
+
+#
+# Function to measure the memory of updating the data (import, clean_data and transform_data)
+# The synthetic data is written as tracker CSV to a temporary folder and imported from there,
+# with the compact types and without them (data_schema 'untyped') as baseline.
+# Returns the peak of memory allocated by Python and the memory of the imported and prepared data (MB).
+#
+def benchmark_memory(regions=1500, days=880, gap_rate=0.1, outlier_rate=0.001):
+
+    print(
+        f"\nMemory of the data update on synthetic data: {regions} regions x {days} days.\n"
+    )
+
+    memory = {}
+
+    with tempfile.TemporaryDirectory() as temp_path:
+        source_file = temp_path + '/tracker.csv'
+        synthetic_tracker(regions, days, gap_rate, outlier_rate).rename(
+            columns={'cases': 'cases_daily'}
+        ).to_csv(source_file, sep=';', index=False)
+
+        for schema in ['untyped', 'compact']:
+            job = {
+                'source_file': source_file,
+                'limit_dates': False,
+                'data_schema': schema,
+            }
+
+            with batch.job_conf(job), contextlib.redirect_stdout(io.StringIO()):
+                tracemalloc.start()
+                try:
+                    covid_raw = prep.import_data()
+                    covid_clean = prep.clean_data(covid_raw)
+                    covid_calc, covid_calc_weekly = prep.transform_data(covid_clean)
+                    peak = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+
+            memory[schema] = {
+                'peak_mb': round(peak / 1024**2, 1),
+                'imported_mb': frame_size(covid_raw),
+                'prepared_mb': frame_size(covid_calc),
+                'prepared_weekly_mb': frame_size(covid_calc_weekly),
+            }
+
+            del covid_raw, covid_clean, covid_calc, covid_calc_weekly
+
+    print(f"{'Memory (MB)':<24} {'Untyped':>10} {'Compact':>10} {'Change':>8}")
+
+    for key, label in [
+        ('peak_mb', 'Peak'),
+        ('imported_mb', 'Imported data'),
+        ('prepared_mb', 'Prepared data (daily)'),
+        ('prepared_weekly_mb', 'Prepared data (weekly)'),
+    ]:
+        before, after = memory['untyped'][key], memory['compact'][key]
+        print(f"{label:<24} {before:>10} {after:>10} {after / before - 1:>+8.0%}")
+
+    return memory
+
+
+#
+# Function to get the memory of a dataframe (MB)
+#
+def frame_size(covid_data):
+
+    return round(covid_data.memory_usage(deep=True).sum() / 1024**2, 1)
+
+
+#
+# Function to run the benchmark suite on synthetic data and save the results as JSON
+#
+def benchmark_suite(
+    regions=1500, days=880, gap_rate=0.1, outlier_rate=0.001, frames=5, repeat=1
+):
+
+    # Calculate height etc. as for the script
+    misc.conf_defaults()
+
+    params = {
+        'regions': regions,
+        'days': days,
+        'gap_rate': gap_rate,
+        'outlier_rate': outlier_rate,
+        'frames': frames,
+        'repeat': repeat,
+    }
+
+    print(f"\nBenchmark on synthetic data: {regions} regions x {days} days.\n")
+
+    covid_raw = synthetic_tracker(regions, days, gap_rate, outlier_rate)
+    results = {}
+
+    covid_calc = benchmark_prepare(covid_raw, results, repeat=repeat)
+    benchmark_plot(covid_calc, results, frames=frames, repeat=repeat)
+
+    report = {
+        'datetime': dt.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': params,
+        'results': results,
+    }
+
+    file = pathlib.Path(RESULTS_PATH) / (
+        dt.datetime.now().strftime('%Y%m%d-%H%M%S') + '.json'
+    )
+    file.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(file, 'w') as result_file:
+        json.dump(report, result_file, indent=2)
+
+    print(f"\nResults saved to {file}")
+
+    return report
+
+
+#
+# Function to compare results of the benchmark suite to a baseline (results of an earlier run)
+# Stages taking more than threshold (share) and more than a millisecond longer than in the baseline
+# are reported as regressions.
+#
+def benchmark_compare(report, baseline, threshold=0.2):
+
+    if baseline['params'] != report['params']:
+        print(
+            "\nNOTICE: Baseline was measured with different parameters:",
+            baseline['params'],
+        )
+
+    print(f"\n{'Stage':<32} {'Baseline':>10} {'Now':>10} {'Change':>8}")
+
+    regressions = []
+
+    for name, duration in report['results'].items():
+        before = baseline['results'].get(name)
+
+        if before is None:
+            print(f"{name:<32} {'-':>10} {duration:>10.4f}")
+            continue
+
+        change = duration / before - 1 if before else 0
+        flag = ''
+        if change > threshold and duration - before > 0.001:
+            regressions.append(name)
+            flag = '  REGRESSION'
+
+        print(f"{name:<32} {before:>10.4f} {duration:>10.4f} {change:>+8.0%}{flag}")
+
+    if regressions:
+        print(
+            f"\n{len(regressions)} stages more than {threshold:.0%} slower than the baseline."
+        )
+    else:
+        print("\nNo regressions.")
+
+    return regressions
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+
+import requests
+
+# Size of the chunks streamed to disk and read for hashing
+CHUNK_SIZE = 1024 * 1024
+
+
+#
+# Function to download a file only if the remote file changed
+# The file is streamed to a temporary file and renamed when complete, so an interrupted download
+# never leaves a partial file behind. Returns the download state with a 'changed' flag.
+#
+def download_file(url, local_file, timeout=60):
+
+    state = download_state(local_file)
+
+    # Ask the server to only send the file if it changed since the last download.
+    # Only do so if the local copy is still the file that was downloaded.
+    headers = {'Accept-Encoding': 'gzip'}
+    if state.get('url') == url and state.get('sha256') == file_hash(local_file):
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('last_modified'):
+            headers['If-Modified-Since'] = state['last_modified']
+
+    with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+
+        if response.status_code == 304:
+            return {**state, 'changed': False}
+
+        response.raise_for_status()
+
+        # Stream response (decoded if sent with gzip encoding) to a temporary file in the target folder
+        path = pathlib.Path(local_file)
+        sha256 = hashlib.sha256()
+        size = 0
+        temp_fd, temp_file = tempfile.mkstemp(dir=path.parent, prefix=path.name + '.')
+
+        try:
+            with os.fdopen(temp_fd, 'wb') as file:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    file.write(chunk)
+                    sha256.update(chunk)
+                    size += len(chunk)
+
+                file.flush()
+                os.fsync(file.fileno())
+
+            # Check that the whole file was received if the server announced its size
+            expected = response.headers.get('Content-Length')
+            if expected and 'Content-Encoding' not in response.headers:
+                if size != int(expected):
+                    raise IOError(
+                        f"Incomplete download of {url}: {size} of {expected} bytes"
+                    )
+
+            os.replace(temp_file, local_file)
+
+        except BaseException:
+            os.remove(temp_file)
+            raise
+
+        state = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'sha256': sha256.hexdigest(),
+            'size': size,
+        }
+
+    changed = state['sha256'] != download_state(local_file).get('sha256')
+    save_download_state(local_file, state)
+
+    return {**state, 'changed': changed}
+
+
+#
+# Function to get the SHA-256 hash of a file (None if the file does not exist)
+#
+def file_hash(file):
+
+    if not pathlib.Path(file).exists():
+        return None
+
+    sha256 = hashlib.sha256()
+    with open(file, 'rb') as data:
+        for chunk in iter(lambda: data.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+#
+# Functions to read and save the state of the last download, stored next to the downloaded file
+#
+def download_state_file(local_file):
+
+    return str(local_file) + '.download.json'
+
+
+def download_state(local_file):
+
+    state_file = pathlib.Path(download_state_file(local_file))
+
+    if not state_file.exists():
+        return {}
+
+    with open(state_file) as file:
+        return json.load(file)
+
+
+def save_download_state(local_file, state):
+
+    with open(download_state_file(local_file), 'w') as file:
+        json.dump(state, file, indent=2)
@@ -0,0 +1,114 @@
+import hashlib
+import os
+import pathlib
+import shutil
+
+# Folder for the cached frames
+CACHE_PATH = 'export/cache/frames'
+
+
+#
+# Function to get the key of a frame from everything the rendered image depends on
+# For Kaleido, this is the JSON of the figure (including the colors of the map and the annotations)
+# and the export arguments. As the colors depend on the break points and the position of the date
+# on the last date of the dataset, new data usually changes the key of every frame.
+#
+def frame_key(figure_json, image_format, width, height):
+
+    key = hashlib.sha256()
+    key.update(f"{image_format}-{width}x{height}\n".encode('utf-8'))
+    key.update(figure_json.encode('utf-8'))
+
+    return key.hexdigest()
+
+
+#
+# Function to get the path of a cached frame
+#
+def frame_path(key, image_format):
+
+    return pathlib.Path(CACHE_PATH) / key[:2] / (key + '.' + image_format)
+
+
+#
+# Function to get a cached frame (None if it is not cached)
+#
+def frame_get(key, image_format):
+
+    path = frame_path(key, image_format)
+
+    try:
+        with open(path, 'rb') as file:
+            frame = file.read()
+    except FileNotFoundError:
+        return None
+
+    # Mark the frame as recently used
+    os.utime(path)
+
+    return frame
+
+
+#
+# Function to add a frame to the cache
+# The frame is written to a temporary file first, so other processes never read a partial file.
+#
+def frame_put(key, image_format, frame):
+
+    path = frame_path(key, image_format)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    temp_file = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(temp_file, 'wb') as file:
+        file.write(frame)
+
+    os.replace(temp_file, path)
+
+
+#
+# Function to save a cached frame as image file, as hard link if possible
+#
+def frame_link(key, image_format, file):
+
+    path = frame_path(key, image_format)
+
+    # Replace an existing file instead of writing to it, as it may be linked to another cached frame
+    pathlib.Path(file).unlink(missing_ok=True)
+
+    try:
+        os.link(path, file)
+    except OSError:
+        shutil.copyfile(path, file)
+
+
+#
+# Function to remove the least recently used frames until the cache is below the maximum size (in MB)
+#
+def frame_evict(max_size):
+
+    files = []
+    for path in pathlib.Path(CACHE_PATH).glob('*/*.*'):
+        if path.suffix == '.tmp':
+            continue
+
+        # Skip frames removed in the meantime by another process
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+
+        files.append((stat.st_mtime, stat.st_size, path))
+
+    size = sum(file_size for _, file_size, _ in files)
+
+    removed = 0
+    for _, file_size, path in sorted(files, key=lambda file: file[0]):
+        if size <= max_size * 1024 * 1024:
+            break
+
+        path.unlink(missing_ok=True)
+        size -= file_size
+        removed += 1
+
+    if removed:
+        print(f"Removed {removed} frames from the frame cache.")
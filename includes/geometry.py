@@ -0,0 +1,307 @@
+import hashlib
+import json
+import pathlib
+
+import numpy as np
+
+import includes.download as download
+
+# Folder for the geometry caches, one per GeoJSON file
+CACHE_PATH = 'data/cache'
+
+
+#
+# Function to get the geometry cache of a GeoJSON file, building it if necessary
+# If ids are given, only these features are kept. If a zoom level is given, the geometry is simplified
+# for it. Each variant is cached separately, and all are rebuilt if the hash of the GeoJSON file changed.
+# The caches are saved to cache_path.
+#
+def geometry_cache(file_name, ids=None, zoom=None, tolerance=0, cache_path=CACHE_PATH):
+
+    source_hash = download.file_hash(file_name)
+
+    # Without zoom level, the geometry is not simplified
+    if zoom is None:
+        tolerance = 0
+
+    variant = ''
+    if ids is not None or zoom is not None:
+        key = json.dumps([list(ids) if ids is not None else None, zoom, tolerance])
+        variant = '-' + hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+    cache_file = pathlib.Path(cache_path) / (
+        pathlib.Path(file_name).stem + variant + '.npz'
+    )
+
+    if cache_file.exists():
+        with np.load(cache_file) as cached:
+            cache = dict(cached)
+
+        if cache['sha256'] == source_hash:
+            return cache
+
+    if variant:
+        cache = geometry_cache(file_name, cache_path=cache_path)
+
+        if ids is not None:
+            cache = geometry_prune(cache, ids)
+
+        if zoom is not None and tolerance:
+            cache = geometry_simplify(cache, zoom, tolerance)
+
+    else:
+        print(f"Building geometry cache for {file_name}.")
+
+        with open(file_name, 'r') as file:
+            geojson = json.load(file)
+
+        cache = geometry_pack(geojson)
+        cache['sha256'] = np.array(source_hash)
+
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(cache_file, **cache)
+
+    return cache
+
+
+#
+# Function to pack the features of a GeoJSON FeatureCollection into flat arrays
+# All coordinates are stored in one array. Offsets mark where each ring, polygon, and feature starts.
+#
+def geometry_pack(geojson):
+
+    coordinates = []
+    ring_offsets = [0]
+    polygon_offsets = [0]
+    feature_offsets = [0]
+    multi = []
+
+    for feature in geojson['features']:
+        geometry = feature['geometry']
+        multi.append(geometry['type'] == 'MultiPolygon')
+
+        polygons = geometry['coordinates'] if multi[-1] else [geometry['coordinates']]
+
+        for polygon in polygons:
+            for ring in polygon:
+                coordinates.extend(ring)
+                ring_offsets.append(len(coordinates))
+
+            polygon_offsets.append(len(ring_offsets) - 1)
+
+        feature_offsets.append(len(polygon_offsets) - 1)
+
+    # Everything but the coordinates, e.g. the CRS and the properties of each feature
+    # (keeping the position of the features in the collection)
+    collection = {
+        key: None if key == 'features' else value for key, value in geojson.items()
+    }
+    properties = [feature.get('properties', {}) for feature in geojson['features']]
+
+    return {
+        'coordinates': np.array(coordinates, dtype=np.float64).reshape(-1, 2),
+        'ring_offsets': np.array(ring_offsets, dtype=np.int64),
+        'polygon_offsets': np.array(polygon_offsets, dtype=np.int64),
+        'feature_offsets': np.array(feature_offsets, dtype=np.int64),
+        'multi': np.array(multi, dtype=bool),
+        'ids': np.array([feature.get('id') for feature in geojson['features']]),
+        'collection': np.array(json.dumps(collection)),
+        'properties': np.array(json.dumps(properties)),
+    }
+
+
+#
+# Function to get the index of each feature by its id (e.g. the NUTS_ID)
+#
+def geometry_index(cache):
+
+    return {feature_id: index for index, feature_id in enumerate(cache['ids'].tolist())}
+
+
+#
+# Function to rebuild a GeoJSON FeatureCollection from the geometry cache
+# Rings are views of the packed coordinates, which Plotly serializes like nested lists.
+# If ids are given, only these features are included.
+#
+def geometry_geojson(cache, ids=None):
+
+    index = geometry_index(cache)
+    indices = (
+        range(len(index))
+        if ids is None
+        else sorted(index[i] for i in ids if i in index)
+    )
+
+    # Split the packed coordinates into rings (as views) and the rings into polygons
+    rings = np.split(cache['coordinates'], cache['ring_offsets'][1:-1])
+    polygon_offsets = cache['polygon_offsets'].tolist()
+    feature_offsets = cache['feature_offsets'].tolist()
+    multi = cache['multi'].tolist()
+    feature_ids = cache['ids'].tolist()
+    properties = json.loads(str(cache['properties']))
+
+    features = []
+
+    for feature in indices:
+        polygons = [
+            rings[polygon_offsets[polygon] : polygon_offsets[polygon + 1]]
+            for polygon in range(feature_offsets[feature], feature_offsets[feature + 1])
+        ]
+
+        features.append(
+            {
+                'type': 'Feature',
+                'geometry': {
+                    'type': 'MultiPolygon' if multi[feature] else 'Polygon',
+                    'coordinates': polygons if multi[feature] else polygons[0],
+                },
+                'properties': properties[feature],
+                'id': feature_ids[feature],
+            }
+        )
+
+    collection = json.loads(str(cache['collection']))
+    collection['features'] = features
+
+    return collection
+
+
+#
+# Function to get the geometry cache reduced to the features with the given ids
+# Their properties are removed, as only the id is needed to match them with the data.
+#
+def geometry_prune(cache, ids):
+
+    geojson = geometry_geojson(cache, ids)
+    for feature in geojson['features']:
+        feature['properties'] = {}
+
+    return {**geometry_pack(geojson), 'sha256': cache['sha256']}
+
+
+#
+# Function to simplify the geometry for a map rendered at the given zoom level
+# Coordinates are quantized to a grid finer than the tolerance (in pixels) and lines simplified with
+# the Douglas-Peucker algorithm. Shared borders are split at the same points and simplified once,
+# so neighbouring regions keep fitting together without gaps or overlaps.
+#
+def geometry_simplify(cache, zoom, tolerance):
+
+    # Size of a pixel in degrees (Mapbox tiles are 512 pixels wide), for latitudes also in the far north
+    pixel = 360 / (512 * 2**zoom)
+    decimals = int(np.ceil(-np.log10(pixel * np.cos(np.radians(72)) * tolerance / 4)))
+
+    # Quantize coordinates and remove points that became duplicates of the previous point
+    coordinates = np.round(cache['coordinates'], decimals)
+    rings = np.split(coordinates, cache['ring_offsets'][1:-1])
+    rings = [
+        ring[np.r_[True, (np.diff(ring, axis=0) != 0).any(axis=1)]] for ring in rings
+    ]
+
+    # Ids of identical points and the points next to them in each ring (without the closing point)
+    open_rings = [ring[:-1] for ring in rings]
+    _, point_ids = np.unique(np.concatenate(open_rings), axis=0, return_inverse=True)
+    point_ids = point_ids.reshape(-1)
+    ring_ids = np.split(point_ids, np.cumsum([len(ring) for ring in open_rings])[:-1])
+
+    neighbours = np.concatenate(
+        [
+            np.stack([ids, np.roll(ids, shift)], axis=1)
+            for ids in ring_ids
+            for shift in [1, -1]
+        ]
+    )
+
+    # Points where borders meet (more or less than two different neighbours) and the first point of
+    # each ring are kept in all rings
+    neighbours = np.unique(neighbours, axis=0)
+    fixed = np.bincount(neighbours[:, 0]) != 2
+    fixed[[ids[0] for ids in ring_ids]] = True
+
+    # Project to pixels in Web Mercator for measuring distances
+    projected = np.concatenate(rings)
+    projected = np.stack(
+        [
+            np.radians(projected[:, 0]),
+            np.log(np.tan(np.pi / 4 + np.radians(projected[:, 1]) / 2)),
+        ],
+        axis=1,
+    ) * (512 * 2**zoom / (2 * np.pi))
+    projected_rings = np.split(projected, np.cumsum([len(ring) for ring in rings])[:-1])
+
+    simplified = {}
+    simplified_rings = []
+
+    for ring, projected_ring, ids in zip(rings, projected_rings, ring_ids):
+        ids = np.append(ids, ids[0])
+
+        # Split the ring into arcs between fixed points. Rings without other fixed points are also
+        # split at the point with the highest id, the same point in all rings using it.
+        splits = np.flatnonzero(fixed[ids])
+        if len(splits) == 2 and len(ids) > 3:
+            splits = np.insert(splits, 1, 1 + np.argmax(ids[1:-1]))
+
+        keep = [0]
+        for start, end in zip(splits[:-1], splits[1:]):
+
+            # Simplify each arc once, in the same direction for all rings using it
+            arc = tuple(ids[start : end + 1])
+            reverse = arc[::-1] < arc
+            key = arc[::-1] if reverse else arc
+
+            if key not in simplified:
+                points = projected_ring[start : end + 1]
+                simplified[key] = douglas_peucker(
+                    points[::-1] if reverse else points, tolerance
+                )
+
+            kept = simplified[key]
+            if reverse:
+                kept = (end - start) - kept[::-1]
+
+            keep.extend(start + kept[1:])
+
+        # Keep rings that would collapse unchanged
+        simplified_rings.append(ring[keep] if len(keep) >= 4 else ring)
+
+    ring_offsets = np.cumsum([0] + [len(ring) for ring in simplified_rings])
+
+    return {
+        **cache,
+        'coordinates': np.concatenate(simplified_rings),
+        'ring_offsets': ring_offsets,
+    }
+
+
+#
+# Function to get the positions of the points kept when simplifying a line with the Douglas-Peucker
+# algorithm
+#
+def douglas_peucker(points, tolerance):
+
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        # Distance of the points in between to the line from start to end
+        dx, dy = points[end] - points[start]
+        offsets = points[start + 1 : end] - points[start]
+        length = np.hypot(dx, dy)
+
+        if length > 0:
+            distances = np.abs(dx * offsets[:, 1] - dy * offsets[:, 0]) / length
+        else:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            middle = start + 1 + farthest
+            keep[middle] = True
+            stack.extend([(start, middle), (middle, end)])
+
+    return np.flatnonzero(keep)
@@ -0,0 +1,339 @@
+import json
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+import includes.prepare as prep
+from settings import conf  # Import configuration defined in settings.py
+
+
+#
+# Function to update the prepared data incrementally
+# Only the trailing part of each NUTS region depending on new or changed source data is recalculated.
+# The result is the same as cleaning and transforming the whole dataset again.
+#
+def update_incremental(covid_raw):
+
+    print("\nUpdate data incrementally.")
+
+    # Remove negative values and NUTS regions irrelevant to the map (as in clean_data())
+    covid_filtered = prep.clean_remove_nuts(prep.clean_remove_neg(covid_raw))
+
+    # Previously prepared data and checkpoint of the cleaned source data
+    files = [prep.export_file(suffix) for suffix in ['', '-weekly']]
+    checkpoint_file = prep.export_file(name='covid-waves-checkpoint')
+    settings_file = prep.export_file(extension='json', name='covid-waves-checkpoint')
+    settings = prep.prepared_settings()
+
+    if not all(pathlib.Path(file).exists() for file in [checkpoint_file, *files]):
+        print("\nNo previously prepared data found. Doing a full update.")
+        full_update = True
+
+    # Outliers and columns of the previous data depend on the settings used for it
+    elif not checkpoint_settings_unchanged(settings_file, settings):
+        print("\nSettings changed since the last update. Doing a full update.")
+        full_update = True
+
+    else:
+        full_update = False
+
+    if full_update:
+        is_outlier = prep.outlier_mask(covid_filtered)
+        covid_clean = covid_filtered[~is_outlier].sort_values(['nuts_id', 'date'])
+        covid_calc, covid_calc_weekly = prep.transform_data(covid_clean)
+
+    else:
+        # Read numbers exactly as they were written to get the same results as a full update
+        checkpoint, calc_before, weekly_before = [
+            pd.read_csv(
+                file,
+                index_col=0,
+                parse_dates=['date'],
+                float_precision='round_trip',
+                dtype=prep.schema_types(),
+            )
+            for file in [checkpoint_file, *files]
+        ]
+
+        # Remove outliers, only checking rows near new or changed data
+        is_outlier = incremental_outliers(covid_filtered, checkpoint)
+        print(f"\nRemoved {is_outlier.sum()} extreme outliers.")
+
+        covid_clean = covid_filtered[~is_outlier].sort_values(['nuts_id', 'date'])
+        clean_before = checkpoint[~checkpoint['is_outlier']].drop(columns='is_outlier')
+
+        covid_calc, covid_calc_weekly = incremental_transform(
+            covid_clean, clean_before, calc_before, weekly_before
+        )
+
+    # Save checkpoint for the next update
+    covid_filtered.assign(is_outlier=is_outlier).to_csv(checkpoint_file)
+    with open(settings_file, 'w') as file:
+        json.dump(settings, file, indent=2)
+    print("\nCheckpoint saved as", checkpoint_file)
+
+    return covid_calc, covid_calc_weekly
+
+
+#
+# Function to remove the checkpoint, e.g. after a full update that doesn't save one
+# (the next incremental update would otherwise compare to older source data than the prepared data)
+#
+def remove_checkpoint():
+
+    for file in [
+        prep.export_file(name='covid-waves-checkpoint'),
+        prep.export_file(extension='json', name='covid-waves-checkpoint'),
+    ]:
+        pathlib.Path(file).unlink(missing_ok=True)
+
+
+#
+# Function to check if the checkpoint was saved with the same settings
+#
+def checkpoint_settings_unchanged(settings_file, settings):
+
+    if not pathlib.Path(settings_file).exists():
+        return False
+
+    with open(settings_file) as file:
+        return json.load(file) == json.loads(json.dumps(settings))
+
+
+#
+# Function to get the rows checked for outliers, with their position in each NUTS group
+#
+def outlier_sequence(covid_filtered):
+
+    cases_pop = covid_filtered['cases'] / covid_filtered['population'] * 10000
+
+    sequence = covid_filtered[['nuts_id', 'date', 'population', 'cases']].copy()
+    sequence['row'] = np.arange(len(covid_filtered))
+    sequence = sequence[(cases_pop >= 0).to_numpy()]
+    sequence['position'] = sequence.groupby('nuts_id').cumcount()
+
+    return sequence
+
+
+#
+# Function to get the first position (or date) in each NUTS group where two datasets differ
+#
+def first_change(new, before, keys, columns):
+
+    merged = new.merge(
+        before, on=keys, how='outer', suffixes=('', '_before'), indicator=True
+    )
+
+    # Rows only in one of the datasets or with different values (missing values being equal)
+    # Categorical columns are compared by value, as their categories differ if NUTS regions were
+    # added or renamed
+    changed = merged['_merge'] != 'both'
+    for column in columns:
+        values, values_before = merged[column], merged[column + '_before']
+        if isinstance(values.dtype, pd.CategoricalDtype) or isinstance(
+            values_before.dtype, pd.CategoricalDtype
+        ):
+            values, values_before = values.astype(object), values_before.astype(object)
+
+        changed |= ~((values == values_before) | (values.isna() & values_before.isna()))
+
+    return merged[changed].groupby('nuts_id', observed=True)[keys[1]].min()
+
+
+#
+# Function to get the value of the NUTS id of each row, e.g. the first changed date
+# (reindexing, as Series.map fails for NUTS ids without any value if the values are dates)
+#
+def nuts_values(covid_data, values):
+
+    return pd.Series(
+        values.reindex(covid_data['nuts_id']).to_numpy(), index=covid_data.index
+    )
+
+
+#
+# Function to mark outliers, recalculating only rows whose rolling window contains changed rows
+#
+def incremental_outliers(covid_filtered, checkpoint):
+
+    # Rows within half a window before the first changed row of a group may change,
+    # using a whole window before that as context
+    window = conf['outlier_window']
+    after = (window - 1) // 2
+
+    new = outlier_sequence(covid_filtered)
+    before = outlier_sequence(checkpoint)
+    before['is_outlier'] = checkpoint['is_outlier'].to_numpy()[before['row']]
+
+    changed = first_change(
+        new, before, ['nuts_id', 'position'], ['date', 'population', 'cases']
+    )
+    first_changed = nuts_values(new, changed).fillna(np.inf).to_numpy()
+    position = new['position'].to_numpy()
+
+    is_outlier = np.zeros(len(covid_filtered), dtype=bool)
+
+    # Keep the outliers found before for unchanged rows
+    keep = position < first_changed - after
+    kept = new[keep].merge(
+        before[['nuts_id', 'position', 'is_outlier']], on=['nuts_id', 'position']
+    )
+    is_outlier[kept['row']] = kept['is_outlier'].to_numpy(dtype=bool)
+
+    # Check all other rows (with context)
+    context = position >= first_changed - (window - 1)
+    rows = new['row'].to_numpy()[context]
+    recheck = ~keep[context]
+    is_outlier[rows[recheck]] = prep.outlier_mask(covid_filtered.iloc[rows])[recheck]
+
+    print(
+        f"\nChecked {recheck.sum()} of {len(new)} rows for outliers "
+        f"in {len(changed)} changed NUTS regions."
+    )
+
+    return is_outlier
+
+
+#
+# Function to calculate the trailing part of the transformed data depending on changed data
+#
+def incremental_transform(covid_clean, clean_before, calc_before, weekly_before):
+
+    date_min = covid_clean['date'].min()
+    date_max = covid_clean['date'].max()
+    date_max_before = clean_before['date'].max()
+    day = pd.Timedelta(days=1)
+
+    # Recalculate everything if the time frame doesn't just get longer
+    if date_min != clean_before['date'].min() or date_max < date_max_before:
+        print("\nTime frame of the data changed. Doing a full update.")
+        return prep.transform_data(covid_clean)
+
+    # First changed date for each NUTS id, new dates counting as changed for all NUTS ids
+    nuts_ids = pd.Index(covid_clean['nuts_id'].unique())
+    changed = first_change(
+        covid_clean,
+        clean_before,
+        ['nuts_id', 'date'],
+        ['country', 'nuts_name', 'population', 'cases'],
+    )
+
+    # Recalculate everything if NUTS regions were removed
+    if not changed.index.isin(nuts_ids).all():
+        print("\nNUTS regions were removed. Doing a full update.")
+        return prep.transform_data(covid_clean)
+
+    if date_max > date_max_before:
+        changed = (
+            changed.reindex(nuts_ids)
+            .fillna(date_max_before + day)
+            .clip(upper=date_max_before + day)
+        )
+
+    if changed.empty:
+        print("\nNo changes in the data.")
+        return prep.schema_apply(calc_before), prep.schema_apply(weekly_before)
+
+    # Last known value before the first change, which interpolated values after it depend on
+    clean_changed = covid_clean[covid_clean['nuts_id'].isin(changed.index)]
+    first_changed = nuts_values(clean_changed, changed)
+    recalc = (
+        clean_changed[clean_changed['date'] < first_changed]
+        .groupby('nuts_id')['date']
+        .max()
+        .reindex(changed.index)
+    )
+
+    # Moving averages from that date on need context of the longest moving window (in days or weeks)
+    # plus the row before it, as they are calculated from differences of cumulated values.
+    # The context starts at the beginning of a week (Tuesday, weeks end on Monday).
+    windows = [window for window, _ in prep.moving_windows('daily').values()]
+    windows_weekly = [window for window, _ in prep.moving_windows('weekly').values()]
+    week_start = recalc - pd.to_timedelta((recalc.dt.dayofweek - 1) % 7, unit='D')
+    context_needed = np.minimum(
+        recalc - max(windows, default=0) * day,
+        week_start - 7 * max(windows_weekly, default=0) * day,
+    )
+    start = context_needed - pd.to_timedelta(
+        (context_needed.dt.dayofweek - 1) % 7, unit='D'
+    )
+
+    # Recalculate NUTS regions completely if there is no data or not enough time before the change
+    # or static values are missing
+    missing_static = (
+        (clean_changed[['country', 'nuts_name', 'population']].isna().any(axis=1))
+        .groupby(clean_changed['nuts_id'])
+        .any()
+        .reindex(changed.index, fill_value=False)
+    )
+    complete = recalc.isna() | (start - day < date_min) | missing_static
+    start[complete] = date_min
+    recalc[complete] = date_min
+    seeded = start[~complete]
+
+    print(
+        f"\nRecalculate {len(changed)} NUTS regions "
+        f"({complete.sum()} completely, the others from {recalc[~complete].min()})."
+    )
+
+    # Context until the last known value is taken from the previous data (with interpolated values),
+    # recalculated rows from the new data
+    calc_context = calc_before[
+        (calc_before['date'] >= nuts_values(calc_before, seeded))
+        & (calc_before['date'] <= nuts_values(calc_before, recalc))
+    ]
+    calc_context = calc_context.assign(cases=calc_context['cases'].replace(-1, np.nan))
+    tail = clean_changed[
+        clean_changed['date'] > nuts_values(clean_changed, recalc[~complete])
+    ]
+    tail_complete = clean_changed[
+        clean_changed['nuts_id'].isin(complete[complete].index)
+    ]
+
+    # Empty rows at the first and the last date, so the recalculated rows cover the same dates
+    boundary_rows = pd.DataFrame(
+        {'nuts_id': changed.index[0], 'date': [date_min, date_max]}
+    )
+
+    tail = pd.concat(
+        [calc_context, tail, tail_complete, boundary_rows], ignore_index=True
+    ).drop_duplicates(['nuts_id', 'date'])[covid_clean.columns]
+
+    # Cumulated values before the context
+    seed_dates = pd.DataFrame(
+        {'nuts_id': seeded.index.to_numpy(), 'date': (seeded - day).to_numpy()}
+    )
+    calc_seed = calc_before.merge(seed_dates)
+    weekly_seed = weekly_before.merge(seed_dates)
+    seeds = (
+        calc_seed.set_index('nuts_id')['cumulated_pop'].replace(-1, np.nan),
+        weekly_seed.set_index('nuts_id')['cumulated_pop_w'],
+    )
+    tail_calc, tail_weekly = prep.transform_data(tail, seeds=seeds)
+
+    # Combine previous data before and recalculated data after the last known value for each NUTS id
+    # (with the types of a full update)
+    def combine(before, recalculated):
+        recalc_before = nuts_values(before, recalc)
+        recalc_after = nuts_values(recalculated, recalc)
+
+        combined = pd.concat(
+            [
+                before[~(before['date'] >= recalc_before)],
+                recalculated[recalculated['date'] >= recalc_after],
+            ]
+        )
+
+        return (
+            prep.schema_apply(combined)
+            .sort_values(['nuts_id', 'date'])
+            .reset_index(drop=True)
+        )
+
+    covid_calc = combine(calc_before, tail_calc)
+
+    # Weekly data is sorted by date like in transform_fork_weekly()
+    covid_calc_weekly = combine(weekly_before, tail_weekly).sort_values('date')
+
+    return covid_calc, covid_calc_weekly
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import pathlib
+
+import includes.download as download
+
+# File in the folder of the images listing the job and each completed image
+MANIFEST_FILE = 'manifest.jsonl'
+
+
+#
+# Function to describe a rendering job by everything its images depend on
+# The hashes of the base figure and the values of all frames cover the data, colors and layout,
+# the other entries the output of the renderer.
+#
+def manifest_job(figure_json, values, dates, date_range, settings):
+
+    values_hash = hashlib.sha256(values.tobytes())
+    values_hash.update(str([str(date) for date in dates]).encode('utf-8'))
+    values_hash.update(str([str(date) for date in date_range]).encode('utf-8'))
+
+    return {
+        'figure': hashlib.sha256(figure_json.encode('utf-8')).hexdigest(),
+        'values': values_hash.hexdigest(),
+        'frames': len(dates),
+        **settings,
+    }
+
+
+#
+# Function to read a manifest: the job (first line) and the checksum of each completed image
+# A line left incomplete by an interrupted run is ignored.
+#
+def manifest_read(export_path):
+
+    job, frames = None, {}
+
+    with open(pathlib.Path(export_path) / MANIFEST_FILE) as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+
+            if job is None:
+                job = entry
+            else:
+                frames[entry['file']] = entry['sha256']
+
+    return job, frames
+
+
+#
+# Function to start or resume a job in a folder of images
+# Returns the index of the first image missing or not matching its checksum. The manifest is rewritten
+# with the images before it, so the images rendered from there on are added in order.
+#
+def manifest_start(export_path, job, image_files):
+
+    manifest_file = pathlib.Path(export_path) / MANIFEST_FILE
+    start = 0
+
+    if manifest_file.exists():
+        job_done, frames = manifest_read(export_path)
+
+        if job_done != job:
+            raise ValueError(
+                f"The images in {export_path} were rendered with other data or settings. "
+                "Resuming is only possible with the same data and settings."
+            )
+
+        for file in image_files:
+            name = pathlib.Path(file).name
+            if name not in frames or download.file_hash(file) != frames[name]:
+                break
+            start += 1
+
+    # Write to a temporary file first, so the manifest is never lost
+    temp_file = manifest_file.with_name(manifest_file.name + '.tmp')
+    with open(temp_file, 'w') as file:
+        file.write(json.dumps(job) + '\n')
+        for image_file in image_files[:start]:
+            file.write(manifest_entry(image_file) + '\n')
+
+    os.replace(temp_file, manifest_file)
+
+    return start
+
+
+#
+# Function to get the line of a completed image in the manifest
+#
+def manifest_entry(image_file):
+
+    return json.dumps(
+        {
+            'file': pathlib.Path(image_file).name,
+            'sha256': download.file_hash(image_file),
+        }
+    )
+
+
+#
+# Function to add the images of frames to the manifest as they are completed, passing on the frames
+# Each line is written to disk before the next frame, so an interrupted run loses at most one frame.
+#
+def manifest_record(frames, export_path, image_files):
+
+    with open(pathlib.Path(export_path) / MANIFEST_FILE, 'a') as file:
+        for image_file, frame in zip(image_files, frames):
+            file.write(manifest_entry(image_file) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+            yield frame
@@ -0,0 +1,229 @@
+import base64
+import json
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+# Script playing the frames in the browser (run by plotly after creating the map, see player_script())
+# The values of the frames are loaded in chunks (decoded once, embedded or fetched from files as needed,
+# prefetching the next chunk). Each frame then only replaces 'z' and the date annotation.
+PLAYER_SCRIPT = '''
+var gd = document.getElementById('{plot_id}');
+var player = __PLAYER__;
+
+var chunks = {};
+
+function decode(buffer) {
+    return player.dtype === 'float32' ? new Float32Array(buffer) : new Uint8Array(buffer);
+}
+
+function loadChunk(chunk) {
+    if (!(chunk in chunks)) {
+        var entry = player.chunks[chunk];
+        if (entry.values !== undefined) {
+            var raw = atob(entry.values);
+            var bytes = new Uint8Array(raw.length);
+            for (var i = 0; i < raw.length; i++) {
+                bytes[i] = raw.charCodeAt(i);
+            }
+            chunks[chunk] = Promise.resolve(decode(bytes.buffer));
+        } else {
+            chunks[chunk] = fetch(entry.file).then(function (response) {
+                if (!response.ok) {
+                    delete chunks[chunk];
+                    throw new Error('Loading ' + entry.file + ' failed: ' + response.status);
+                }
+                return response.arrayBuffer();
+            }).then(decode);
+        }
+    }
+    return chunks[chunk];
+}
+
+function loadFrame(index) {
+    var chunk = 0;
+    while (chunk + 1 < player.chunks.length && player.chunks[chunk + 1].start <= index) {
+        chunk++;
+    }
+    var offset = index - player.chunks[chunk].start;
+    var frame = loadChunk(chunk).then(function (values) {
+        return values.subarray(offset * player.regions, (offset + 1) * player.regions);
+    });
+    // Prefetch the next chunk while the current one is shown
+    if (chunk + 1 < player.chunks.length) {
+        loadChunk(chunk + 1);
+    }
+    return frame;
+}
+
+var dateIndex = gd.layout.annotations.findIndex(function (a) { return a.name === 'date'; });
+var controls = document.createElement('div');
+var button = document.createElement('button');
+var slider = document.createElement('input');
+var current = 0;
+var playing = false;
+
+button.textContent = 'Play';
+slider.type = 'range';
+slider.min = 0;
+slider.max = player.dates.length - 1;
+slider.value = 0;
+slider.style.width = (player.width - 80) + 'px';
+controls.appendChild(button);
+controls.appendChild(slider);
+gd.parentNode.insertBefore(controls, gd.nextSibling);
+
+function show(index) {
+    current = index;
+    slider.value = index;
+
+    return loadFrame(index).then(function (z) {
+        // Skip frames the slider has already been moved past
+        if (index !== current) {
+            return;
+        }
+
+        var layout = {};
+        layout['annotations[' + dateIndex + '].text'] = player.dates[index];
+        layout['annotations[' + dateIndex + '].y'] = player.date_y[index];
+
+        return Plotly.update(gd, {z: [z]}, layout, [0]);
+    });
+}
+
+function play() {
+    if (!playing) {
+        return;
+    }
+    if (current >= player.dates.length - 1) {
+        playing = false;
+        button.textContent = 'Play';
+        return;
+    }
+    var start = performance.now();
+    show(current + 1).then(function () {
+        setTimeout(play, Math.max(0, 1000 / player.fps - (performance.now() - start)));
+    });
+}
+
+button.addEventListener('click', function () {
+    playing = !playing;
+    button.textContent = playing ? 'Pause' : 'Play';
+    if (playing && current >= player.dates.length - 1) {
+        current = -1;
+    }
+    play();
+});
+
+slider.addEventListener('input', function () {
+    playing = false;
+    button.textContent = 'Play';
+    show(parseInt(slider.value, 10));
+});
+
+show(0).then(function () {
+    console.log('First frame shown after ' + Math.round(performance.now()) + ' ms');
+});
+'''
+
+
+#
+# Function to get the positions of the colors on the colorscale (the normalized break points)
+#
+def player_positions(breaks):
+
+    return [0] + list(breaks.values())[1:-1] + [1]
+
+
+#
+# Function to get the positions of the values on the colorscale in 256 levels
+# The levels are evenly spaced between the break points, so each color gets the same number of levels.
+#
+def player_levels(values, breaks, zmax):
+
+    positions = player_positions(breaks)
+    levels = np.interp(values / zmax, positions, np.linspace(0, 255, len(positions)))
+
+    return np.round(levels).astype(np.uint8)
+
+
+#
+# Function to get the values of frames (dates x regions) as typed array for the player
+# 'float32' keeps the values, 'uint8' stores their levels on the colorscale (see player_levels()).
+#
+def player_data(values, breaks, zmax, encoding='float32'):
+
+    if encoding == 'uint8':
+        data = player_levels(values, breaks, zmax)
+    else:
+        data = values.astype('<f4')
+
+    return np.ascontiguousarray(data).tobytes()
+
+
+#
+# Function to get the values of all frames as one chunk embedded in the page (base64)
+#
+def player_embedded(values, breaks, zmax, encoding='float32'):
+
+    data = player_data(values, breaks, zmax, encoding)
+
+    return [{'start': 0, 'values': base64.b64encode(data).decode('ascii')}]
+
+
+#
+# Function to write the values of the frames to files with one chunk of dates each (e.g. one per month)
+# Returns the chunks with the first frame and the file (relative to export_path) of each chunk.
+#
+def player_files(
+    export_path, values, dates, breaks, zmax, encoding='float32', freq='M'
+):
+
+    frames_path = pathlib.Path(export_path) / 'frames'
+    frames_path.mkdir(parents=True, exist_ok=True)
+
+    periods = pd.DatetimeIndex(dates).to_period(freq)
+    starts = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]])
+    chunks = []
+
+    for start, stop in zip(starts, np.r_[starts[1:], len(dates)]):
+        # Named after the first day of the period (e.g. weeks print as a range containing '/')
+        file = f"frames/{periods[start].start_time.strftime('%Y-%m-%d')}.bin"
+
+        with open(pathlib.Path(export_path) / file, 'wb') as chunk_file:
+            chunk_file.write(player_data(values[start:stop], breaks, zmax, encoding))
+
+        chunks.append({'start': int(start), 'file': file})
+
+    return chunks
+
+
+#
+# Function to get the colorscale of a map showing the levels encoded as 'uint8' by player_levels()
+#
+def player_colorscale_levels(colors):
+
+    return [
+        [position, color]
+        for position, color in zip(np.linspace(0, 1, len(colors)).tolist(), colors)
+    ]
+
+
+#
+# Function to get the script playing the frames, to be passed to plotly as post_script
+# chunks: values of the frames, see player_embedded() and player_files()
+#
+def player_script(chunks, regions, dates, date_y, encoding, fps, width):
+
+    player = {
+        'chunks': chunks,
+        'dtype': encoding,
+        'regions': regions,
+        'dates': list(dates),
+        'date_y': list(date_y),
+        'fps': fps,
+        'width': width,
+    }
+
+    return PLAYER_SCRIPT.replace('__PLAYER__', json.dumps(player))
@@ -1,15 +1,30 @@
+import collections
+import concurrent.futures as cf
 import datetime as dt
-import json
+import io
 import pathlib
+import itertools
 import time
 
-import imageio.v3 as iio
 import pandas as pd
 import PIL.Image as Image
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
+import pyarrow.feather as feather
 
+import includes.animation as animation
+import includes.frame_cache as frame_cache
+import includes.geometry as geometry
+import includes.manifest as manifest
 import includes.misc as misc
+import includes.player as player
+import includes.prepare as prep
+import includes.profiler as profiler
+import includes.quantiles as quantiles
+import includes.raster as raster
+import includes.render as render
+import includes.telemetry as telemetry
 from settings import conf  # Import configuration defined in settings.py
 
 
@@ -40,91 +55,111 @@ def custom_template():
     return template
 
 
-#
-# Function to calculate quintiles for the colorscale
-#
-def calc_quantiles(df_q, column_q, normalized=True, base=5):
-    # Steps to be used as break points
-    steps = [0, 0.2, 0.4, 0.6, 0.8, 0.9, 0.95, 0.99, 1]
-    breaks_q = {}
-
-    for step in range(len(steps)):
-        # Calculate quantiles based on the steps defined above
-        breaks_q[steps[step]] = df_q[column_q].quantile(steps[step])
-
-        # Round to next integer for low values (method from https://stackoverflow.com/a/2272174)
-        if breaks_q[steps[step]] < (1.5 * base):
-            breaks_q[steps[step]] = round(df_q[column_q].quantile(steps[step]))
-        # Round to next base for higher values
-        if (1.5 * base) <= breaks_q[steps[step]] < (10 * base):
-            breaks_q[steps[step]] = base * round(
-                df_q[column_q].quantile(steps[step]) / base
-            )
-        # Round to twice the base for very high values
-        if breaks_q[steps[step]] >= 10 * base:
-            breaks_q[steps[step]] = (2 * base) * round(
-                df_q[column_q].quantile(steps[step]) / (2 * base)
-            )
-
-        # Normalize to values between 0 and 1 if selected
-        if normalized:
-            breaks_q[steps[step]] = (
-                breaks_q[steps[step]] / df_q[column_q].max()
-            ).round(3)
-
-    return breaks_q
+# GeoJSON files of NUTS regions and countries by resolution
+GEOJSON_FILE = 'data/{kind}_RG_{resolution}_2016_4326.geojson'
 
 
 #
 # Function to import GeoJson files
+# geojson_file: path of the GeoJSON files (see GEOJSON_FILE), cache_path: folder of the geometry caches
 #
-def import_geojson():
+def import_geojson(
+    nuts_ids=None,
+    simplify=False,
+    geojson_file=GEOJSON_FILE,
+    cache_path=geometry.CACHE_PATH,
+):
 
     print("\nImporting geo data.")
 
-    # Get geo data for NUTS regions (level 3)
-    file_name = 'data/NUTS_RG_' + conf['resolution'] + '_2016_4326.geojson'
-    geo_nuts_level3 = json.load(open(file_name, 'r'))
+    # If set, simplify the geometry to what is visible at the output size
+    zoom = None
+    if simplify and conf['geometry_tolerance']:
+        zoom = misc.calc_zoom()
+
+    # Get geo data for NUTS regions (level 3) from the geometry cache,
+    # only keeping the NUTS regions shown on the map
+    file_name = geojson_file.format(kind='NUTS', resolution=conf['resolution'])
+    cache_nuts = geometry.geometry_cache(
+        file_name, nuts_ids, zoom, conf['geometry_tolerance'], cache_path
+    )
 
     # Get geo data for countries
-    file_name = 'data/CNTR_RG_' + conf['resolution'] + '_2016_4326.geojson'
-    geo_countries = json.load(open(file_name, 'r'))
+    file_name = geojson_file.format(kind='CNTR', resolution=conf['resolution'])
+    cache_countries = geometry.geometry_cache(
+        file_name, None, zoom, conf['geometry_tolerance'], cache_path
+    )
+
+    geo_nuts_level3 = geometry.geometry_geojson(cache_nuts)
+    geo_countries = geometry.geometry_geojson(cache_countries)
 
-    print("Done.")
+    print(
+        f"Done. {len(geo_nuts_level3['features'])} NUTS regions "
+        f"with {len(cache_nuts['coordinates'])} points."
+    )
 
     return geo_nuts_level3, geo_countries
 
 
 #
-# Function to import COVID-19 data from CSV
+# Function to get the file with the prepared data of a metric (daily or weekly data)
+# Falls back to the CSV file (always exported) if there is no file in the columnar format,
+# e.g. for data prepared before data_format was set.
 #
-def import_covid_data():
-
-    print("\nStarting import of CSV file.")
+def data_file(metric):
 
     # Define string to be added to fór weekly metrics
     append = (
         '-weekly'
-        if conf['metric'] in ['cases_pop_weekly', 'moving4w_pop', 'moving8w_pop']
+        if metric in ['cases_pop_weekly', 'moving4w_pop', 'moving8w_pop']
         else ''
     )
 
-    # Define file name to be imported
-    file = 'data/covid-waves-data-clean' + append + '.csv'
+    file = 'data/covid-waves-data-clean' + append + '.' + conf['data_format']
 
-    # Import CSV
-    df_raw = pd.read_csv(
-        file,
-        parse_dates=['date'],
-        usecols=['country', 'nuts_id', 'nuts_name', 'date', conf['metric']],
-        header=0,
-    )
+    if not pathlib.Path(file).exists():
+        file = 'data/covid-waves-data-clean' + append + '.csv'
 
-    print("File imported:", file)
+    return file
+
+
+#
+# Function to import COVID-19 data from CSV
+# Several metrics from the same file can be imported at once (see batch.py).
+#
+def import_covid_data(metrics=None):
+
+    if metrics is None:
+        metrics = [conf['metric']]
+
+    # Define file name to be imported and its format
+    file = data_file(metrics[0])
+    data_format = pathlib.Path(file).suffix[1:]
+    columns = ['country', 'nuts_id', 'nuts_name', 'date'] + list(metrics)
+
+    print(f"\nStarting import of {data_format.upper()} file.")
 
-    df = df_raw.copy()
+    # Import only the columns needed. Feather files are memory-mapped and read without conversion.
+    if data_format == 'feather':
+        df_raw = feather.read_table(file, columns=columns, memory_map=True).to_pandas()
 
-    # If set, reduce data set to requested time frame
+    elif data_format == 'parquet':
+        df_raw = pd.read_parquet(file, columns=columns, memory_map=True)
+
+    else:
+        df_raw = prep.schema_apply(
+            pd.read_csv(
+                file,
+                parse_dates=['date'],
+                usecols=columns,
+                header=0,
+            )
+        )
+
+    print("File imported:", file)
+
+    # If set, reduce data set to requested time frame (selecting the rows returns a new dataframe)
+    df = df_raw
     if conf['set_dates']:
         df = df[(df['date'] >= conf['date_start']) & (df['date'] <= conf['date_end'])]
 
@@ -134,49 +169,225 @@ def import_covid_data():
 #
 # Function to export maps as images if selected mode is 'image'
 #
-def plot_images(df, df_raw, filepath_dt):
+def plot_images(df, df_raw, filepath_dt, job_path=None):
+
+    # Folder for the images, or the folder of an interrupted run to resume
+    # (with the date and time of that run for the animation)
+    # Jobs of a batch (see batch.py) save their images and animation in their own folder.
+    anim_path = 'export/animation/'
+
+    if job_path is not None:
+        export_path = pathlib.Path(job_path) / 'images'
+        anim_path = job_path
+    elif conf['resume_path']:
+        export_path = pathlib.Path(conf['resume_path'])
+        filepath_dt = dt.datetime.strptime(export_path.name, '%Y%m%d-%H%M%S')
+    else:
+        export_path = pathlib.Path(
+            'export/image/' + str(filepath_dt.strftime('%Y%m%d-%H%M%S'))
+        )
 
-    # Get GeoJSON data
-    geo_nuts_level3, geo_countries = import_geojson()
+    # Pivot the metric to one row of values per date and one column per NUTS region
+    with profiler.profiler_stage('frames_matrix'):
+        dates, nuts_ids, values = frames_matrix(df)
 
-    # Create folder
-    export_path = pathlib.Path(
-        'export/image/' + str(filepath_dt.strftime('%Y%m%d-%H%M%S'))
-    )
-    export_path.mkdir(parents=True, exist_ok=True)
+    # Construct the map used for all images and serialize it once
+    # or prepare the layers of the native renderer
+    with profiler.profiler_stage('base_figure'):
+        fig = plot_base_figure(df, df_raw, nuts_ids, values[0])
 
-    image_files = []
+    with profiler.profiler_stage('frame_template'):
+        if conf['render_engine'] == 'native':
+            template = raster.frame_layers(fig, [date_text(date) for date in dates])
+        else:
+            template = render.frame_template(fig)
 
-    # Calculate quintiles for the conf['colorscale'] using whole or reduced dataframe
-    df_breaks = df if conf['colorscale'] == 'sample' else df_raw
-    breaks = calc_quantiles(df_breaks, conf['metric'], normalized=True)
+    print("Created basic map for all images.")
 
-    # Get resize factor
-    factor = misc.calc_factor()
+    # Define file path and name for each date (in the order of the frames)
+    image_files = [
+        f"{export_path}/{pd.to_datetime(date).strftime('%Y-%m-%d')}-"
+        f"{conf['resolution']}-{conf['metric']}-{conf['width']}px.{conf['image_format']}"
+        for date in dates
+    ]
+
+    # Get min and max dates of the whole dataset to position the date annotation
+    date_range = (df_raw['date'].min(), df_raw['date'].max())
+
+    # Write the images to files only if requested or if there is no animation
+    # Otherwise, the rendered frames are passed to the animation encoder directly.
+    # Resumable jobs always save the images, listing the completed ones in a manifest.
+    resumable = conf['resumable'] or bool(conf['resume_path'])
+    save_images = conf['save_images'] or not conf['animation'] or resumable
+    if save_images:
+        export_path.mkdir(parents=True, exist_ok=True)
+
+    # Continue with the first image missing in the folder (or start with the first image)
+    start = 0
+    if resumable:
+        job = manifest.manifest_job(
+            pio.to_json(fig, validate=False),
+            values,
+            dates,
+            date_range,
+            {
+                'render_engine': conf['render_engine'],
+                'image_format': conf['image_format'],
+            },
+        )
+        start = manifest.manifest_start(export_path, job, image_files)
 
-    # Get zoom factor for the map
-    zoom = misc.calc_zoom()
+        if start:
+            print(f"Resuming {export_path}: {start} of {len(dates)} images done.")
+
+    args = (template, values, dates, image_files if save_images else None, date_range)
+    indices = range(start, len(dates))
 
     print("\nStart plotting.\n")
 
-    # Get all unique dates and sort them
-    dates = df['date'].sort_values().unique()
+    # Render all frames, either serially or distributed to a pool of worker processes
+    if conf['workers'] > 1 and len(indices) > 1:
+        frames = plot_images_parallel(*args, indices)
+    else:
+        frames = (plot_images_frame(*args, index) for index in indices)
+
+    if resumable:
+        frames = manifest.manifest_record(frames, export_path, image_files[start:])
+
+    # Name of the job for the telemetry, with the date and time of the run for the log
+    # (logs of resumed runs are continued)
+    job_name = '-'.join(
+        [
+            conf['resolution'],
+            conf['metric'],
+            str(conf['width']) + 'px',
+            conf['image_format'],
+        ]
+    )
+    run_name = filepath_dt.strftime('%Y%m%d-%H%M%S')
+
+    frames = plot_images_progress(
+        frames, image_files, save_images, job_name, run_name, start
+    )
+
+    # Create animation from the frames as they are rendered
+    # (after the images of an interrupted run, loaded from their files)
+    # Rendering and encoding the animation are interleaved, so they are measured as one stage.
+    if conf['animation']:
+        with profiler.profiler_stage('render_stitch'):
+            stitch_animation(
+                image_files,
+                animation_format=conf['animation_format'],
+                fps=conf['animation_fps'],
+                loop=conf['animation_loops'],
+                filepath_dt=filepath_dt,
+                params=[conf['resolution'], conf['metric'], str(conf['width']) + 'px'],
+                frames=itertools.chain(
+                    animation.file_frames(image_files[:start]),
+                    (frame_image(frame) for frame in frames),
+                ),
+                anim_path=anim_path,
+            )
+
+            # The encoder stops reading after the last frame, so let the progress finish (logging the last frame)
+            for _ in frames:
+                pass
+    else:
+        with profiler.profiler_stage('render'):
+            for _ in frames:
+                pass
 
-    # Get min and max dates of the whole dataset
-    first_date = df_raw['date'].min()
-    last_date = df_raw['date'].max()
+    dates_processed = len(indices)
 
-    # Create a new dataframe containing just the rows for the first date and sort it
-    df_plot = df[df['date'] == dates[0]].sort_values(['nuts_id', 'date'])
+    print("\nAll images saved." if save_images else "\nAll images rendered.")
+
+    # Keep the frame cache below its maximum size
+    if conf['render_engine'] != 'native' and conf['frame_cache_size'] > 0:
+        frame_cache.frame_evict(conf['frame_cache_size'])
+
+    return dates_processed
+
+
+#
+# Function to get the text of the date annotation
+#
+def date_text(date):
+
+    return '<b>' + str(pd.to_datetime(date).strftime('%d.%m.%Y')) + '</b>'
+
+
+#
+# Function to get the position of the date annotation, moving down as time passes
+# (using min and max dates of the whole dataset)
+#
+def date_y(date, date_range):
+
+    first_date, last_date = date_range
+    total_seconds = (last_date - first_date).total_seconds()
+    now_seconds = (pd.to_datetime(date) - first_date).total_seconds()
+
+    return 0.9 * (1 - now_seconds / total_seconds * 0.9)
+
+
+#
+# Function to pivot the metric to a matrix of dates (rows) and NUTS regions (columns)
+# Selecting the values of a frame is then just a row of the matrix.
+#
+def frames_matrix(df):
+
+    # Regions without a row for a date get the constant for 'no data available'
+    df_matrix = (
+        df.pivot(index='date', columns='nuts_id', values=conf['metric'])
+        .sort_index()
+        .sort_index(axis=1)
+        .fillna(-1)
+    )
+
+    return (
+        df_matrix.index.to_numpy(),
+        df_matrix.columns.to_numpy(),
+        df_matrix.to_numpy(),
+    )
+
+
+#
+# Function to construct the map used for all images
+# The GeoJSON files and geometry caches can be set (see import_geojson()).
+#
+def plot_base_figure(
+    df,
+    df_raw,
+    nuts_ids,
+    z,
+    simplify=True,
+    geojson_file=GEOJSON_FILE,
+    cache_path=geometry.CACHE_PATH,
+):
+
+    # Get GeoJSON data of the NUTS regions in the data, simplified for the image size if set
+    with profiler.profiler_stage('import_geojson'):
+        geo_nuts_level3, geo_countries = import_geojson(
+            nuts_ids, simplify, geojson_file, cache_path
+        )
+
+    # Get break points for the colorscale and the legend
+    with profiler.profiler_stage('plot_breaks'):
+        breaks, breaks_legend, zmax = plot_breaks(df, df_raw)
+
+    # Get resize factor
+    factor = misc.calc_factor()
+
+    # Get zoom factor for the map
+    zoom = misc.calc_zoom()
 
     # Start plotting constructing the map used for all images
     fig = go.Figure(
         go.Choroplethmapbox(
             geojson=geo_nuts_level3,
-            locations=df_plot['nuts_id'],
-            z=df_plot[conf['metric']],
+            locations=nuts_ids,
+            z=z,
             zmin=0,
-            zmax=df_breaks[conf['metric']].max(),
+            zmax=zmax,
             colorscale=[
                 [0, conf['colors'][0]],
                 [breaks[0.2], conf['colors'][1]],
@@ -272,8 +483,6 @@ def plot_images(df, df_raw, filepath_dt):
             i += 1
 
         # Create annotations using not normalized break points
-        breaks_legend = calc_quantiles(df_breaks, conf['metric'], normalized=False)
-
         i = 0
 
         for step in breaks_legend:
@@ -294,131 +503,276 @@ def plot_images(df, df_raw, filepath_dt):
             )
             i += 1
 
-    print("Created basic map for all images.")
+    # Add annotation for the current date (text and position are set for each frame)
+    fig.add_annotation(
+        dict(
+            name='date',
+            xref='paper',
+            yref='paper',
+            yanchor='top',
+            xanchor='left',
+            x=0.01,
+            y=0.9,
+            showarrow=False,
+            text='',
+            font={
+                'size': 24 * factor,
+            },
+        ),
+    )
 
-    # Set variables to calculate time left
-    duration_total = 0
-    dates_processed = 0
+    # Add attribution (only shown in the last frame)
+    fig.add_annotation(
+        dict(
+            name='attribution',
+            visible=False,
+            font=dict(size=24 * factor),
+            x=0.99,
+            y=0.01,
+            showarrow=False,
+            text='<b>By Jan Kühn</b><br /><sup>https://yotka.org</sup>',
+            xanchor='right',
+            yanchor='bottom',
+            xref='paper',
+            yref='paper',
+            align='right',
+        )
+    )
 
-    # Update the map for all dates and export the image
-    for date in dates:
+    return fig
 
-        # Set variable to track performance
-        time_start = time.time()
 
-        # Convert date to Pandas datetime
-        date = pd.to_datetime(date)
+# Break points calculated by plot_breaks(), by fingerprint of the values of the metric
+breaks_cache = {}
 
-        # Check if this is the last iteration
-        last_run = True if (len(dates) > 1 and date == dates.max()) else False
 
-        # Create a new dataframe containing just the rows for the current date and sort it as above
-        # It is important to sort the same way as above to make sure the numbers match to the right NUTS
-        df_plot = df[df['date'] == date].sort_values(['nuts_id', 'date'])
+#
+# Function to get the break points for the colorscale (normalized and not normalized for the legend)
+# and the maximum value, calculated using whole or reduced dataframe as set in conf['colorscale']
+# They are calculated once for the same values, so jobs of a batch (see batch.py) share them.
+#
+def plot_breaks(df, df_raw):
 
-        # Calculate position of the date
-        total_seconds = (last_date - first_date).total_seconds()
-        now_seconds = (date - first_date).total_seconds()
-        date_position = 0.9 * (1 - now_seconds / total_seconds * 0.9)
+    df_breaks = df if conf['colorscale'] == 'sample' else df_raw
+    values = df_breaks[conf['metric']].to_numpy()
+    key = quantiles.quantiles_fingerprint(values, conf['metric'], conf['breaks_method'])
 
-        # Add annotation with the current date in the first run of the loop
-        if date == dates[0]:
-            fig.add_annotation(
-                dict(
-                    xref='paper',
-                    yref='paper',
-                    yanchor='top',
-                    xanchor='left',
-                    x=0.01,
-                    y=date_position,
-                    showarrow=False,
-                    text='<b>' + str(date.strftime('%d.%m.%Y')) + '</b>',
-                    font={
-                        'size': 24 * factor,
-                    },
-                ),
-            )
+    if key not in breaks_cache:
+        breaks_cache[key] = quantiles.quantiles_breaks(
+            values, method=conf['breaks_method']
+        )
 
-        # Update annotation for all other loop runs
-        if date != dates[0]:
+    return breaks_cache[key]
 
-            # Calculate date of the day before current date (day one week ago for weekly metrics)
-            time_diff = (
-                7
-                if conf['metric']
-                in ['cases_pop_weekly', 'moving4w_pop', 'moving8w_pop']
-                else 1
-            )
-            selector = (pd.to_datetime(date) - dt.timedelta(days=time_diff)).strftime(
-                '%d.%m.%Y'
+
+#
+# Function to update the map for a date and render it
+# Only the values changing between frames are injected into the serialized base figure (see render.py).
+# The frame is written to its image file if image_files is set. It is returned if an animation is created:
+# as encoded image (Kaleido) or as array of pixels (native renderer). The duration of each phase of
+# rendering the frame is returned as well (see telemetry.py).
+#
+def plot_images_frame(template, values, dates, image_files, date_range, index):
+
+    phases = {}
+
+    # Convert date to Pandas datetime
+    date = pd.to_datetime(dates[index])
+
+    # Check if this is the last iteration
+    last_run = True if (len(dates) > 1 and index == len(dates) - 1) else False
+
+    # Calculate position of the date
+    date_position = date_y(date, date_range)
+
+    # Get the figure with the colors of the map ('z') and the date of the current frame
+    # The columns of the matrix have the same order as the locations of the map
+    # Add attribution to the last frame
+    with telemetry.phase(phases, 'slice'):
+        z = values[index]
+
+    if conf['render_engine'] == 'native':
+        # Composite the frame from the prepared layers
+        with telemetry.phase(phases, 'composite'):
+            frame = raster.frame_image(
+                template, z, index, date_position, attribution=last_run
             )
 
-            # Update annotation showing current date
-            fig.update_annotations(
-                # Select the right annotation to update
-                selector={'text': '<b>' + selector + '</b>'},
-                text='<b>' + str(date.strftime('%d.%m.%Y')) + '</b>',
-                y=date_position,
+        if image_files is not None:
+            with telemetry.phase(phases, 'write'):
+                raster.write_frame(frame, image_files[index], conf['image_format'])
+
+    else:
+        # Updating the figure is serializing the values of the frame into the base figure
+        with telemetry.phase(phases, 'serialize'):
+            figure_json = render.frame_json(
+                template,
+                z=z,
+                date_text=date_text(date),
+                date_y=date_position,
+                attribution=last_run,
             )
 
-        # Update colors of the map ('z') with those of the current date
-        fig['data'][0]['z'] = df_plot[conf['metric']]
+        # Reuse the image if the same figure was rendered before (in this or an earlier run)
+        use_cache = conf['frame_cache_size'] > 0
 
-        # Add attribution to the last frame
-        if last_run:
-            fig.add_annotation(
-                dict(
-                    font=dict(size=24 * factor),
-                    x=0.99,
-                    y=0.01,
-                    showarrow=False,
-                    text='<b>By Jan Kühn</b><br /><sup>https://yotka.org</sup>',
-                    xanchor='right',
-                    yanchor='bottom',
-                    xref='paper',
-                    yref='paper',
-                    align='right',
-                )
+        with telemetry.phase(phases, 'cache'):
+            key = frame_cache.frame_key(
+                figure_json, conf['image_format'], conf['width'], conf['height']
+            )
+            frame = (
+                frame_cache.frame_get(key, conf['image_format']) if use_cache else None
             )
 
-        # Define file path and name
-        file = (
-            f"{export_path}/{date.strftime('%Y-%m-%d')}-"
-            f"{conf['resolution']}-{conf['metric']}-{conf['width']}px.{conf['image_format']}"
-        )
+        if frame is None:
+            with telemetry.phase(phases, 'rasterize'):
+                frame = render.render_frame(
+                    figure_json, conf['image_format'], conf['width'], conf['height']
+                )
+
+            if use_cache:
+                with telemetry.phase(phases, 'cache'):
+                    frame_cache.frame_put(key, conf['image_format'], frame)
+
+        # Write map to image file (linked to the cached image)
+        if image_files is not None:
+            with telemetry.phase(phases, 'write'):
+                if use_cache:
+                    frame_cache.frame_link(
+                        key, conf['image_format'], image_files[index]
+                    )
+                else:
+                    with open(image_files[index], 'wb') as image_file:
+                        image_file.write(frame)
+
+    return (frame if conf['animation'] else None), phases
+
+
+#
+# Function to convert a rendered frame to an image for the animation
+#
+def frame_image(frame):
+
+    if isinstance(frame, bytes):
+        return Image.open(io.BytesIO(frame)).convert('RGB')
+
+    return Image.fromarray(frame)
+
+
+#
+# Function to print the progress while frames are rendered, passing on the frames
+# The phases of each frame (including adding it to the animation) are recorded by telemetry.py.
+#
+def plot_images_progress(frames, image_files, save_images, job_name, run_name, start=0):
+
+    stats = telemetry.telemetry_start(
+        job_name,
+        run_name,
+        len(image_files),
+        start,
+        log=conf['telemetry_log'],
+        textfile_path=conf['telemetry_textfile_path'],
+    )
 
-        # Write map to image file
-        fig.write_image(file, width=conf['width'], height=conf['height'], scale=1)
+    # Set variables to calculate time left
+    time_start = time.time()
+    duration_total = 0
+    dates_processed = start
 
-        # Append image to variable for animation
-        image_files.append(file)
+    # Duration of a frame is the time since the previous frame (including e.g. adding it to the animation)
+    for frame, phases in frames:
+
+        telemetry.telemetry_frame(stats, phases)
+        metrics = telemetry.telemetry_metrics(stats)
 
         # Count dates processed and duration
         dates_processed += 1
         duration = time.time() - time_start
+        time_start = time.time()
         duration_total = duration_total + duration
-        duration_left = (duration_total / dates_processed) * (
-            len(dates) - dates_processed
+        duration_left = (duration_total / (dates_processed - start)) * (
+            len(image_files) - dates_processed
+        )
+
+        output = (
+            f"Output saved to {image_files[dates_processed - 1]}"
+            if save_images
+            else f"Rendered frame {pathlib.Path(image_files[dates_processed - 1]).stem}"
         )
 
         print(
-            f"Output saved to {file} (duration: {round(duration, 1)} seconds) "
-            f"{dates_processed} of {len(dates)} "
-            f"({round(dates_processed / len(dates) * 100, 2)}%) "
+            f"{output} (duration: {round(duration, 1)} seconds, {round(metrics['fps'], 2)} fps) "
+            f"{dates_processed} of {len(image_files)} "
+            f"({round(dates_processed / len(image_files) * 100, 2)}%) "
             f"left: ~{dt.timedelta(seconds=round(duration_left, 0))}"
         )
 
-    print("\nAll images saved.")
+        # Time until the next frame is requested, i.e. for adding the frame to the animation
+        time_yield = time.perf_counter()
 
-    # Create animation
-    if conf['animation']:
-        stitch_animation(
-            image_files,
-            filepath_dt=filepath_dt,
-            params=[conf['resolution'], conf['metric'], str(conf['width']) + 'px'],
+        yield frame
+
+        if conf['animation']:
+            phases = {**phases, 'animation': time.perf_counter() - time_yield}
+            stats['phases']['animation'] += phases['animation']
+
+        telemetry.telemetry_log(
+            stats, dates_processed - 1, image_files[dates_processed - 1], phases
         )
 
-    return dates_processed
+    telemetry.telemetry_summary(stats)
+
+
+#
+# Function to distribute the images to a pool of worker processes
+# Each worker gets its own copy of the serialized base figure and starts its own Kaleido instance.
+# Frames are returned in order, with a limited number of frames rendered ahead.
+#
+def plot_images_parallel(template, values, dates, image_files, date_range, indices):
+
+    workers = min(conf['workers'], len(indices))
+
+    print(f"Rendering {len(indices)} images using {workers} worker processes.\n")
+
+    with cf.ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=plot_images_worker_init,
+        initargs=(template, values, dates, image_files, date_range, conf),
+    ) as executor:
+        pending = collections.deque()
+
+        for index in indices:
+            pending.append(executor.submit(plot_images_worker, index))
+
+            # Wait for the oldest frame (re-raising errors from the workers)
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+# State of a worker process, set by plot_images_worker_init()
+worker_state = {}
+
+
+#
+# Function to initialize a worker process for plot_images_parallel()
+#
+def plot_images_worker_init(template, values, dates, image_files, date_range, config):
+
+    # Use the configuration of the parent process (e.g. calculated height)
+    conf.update(config)
+
+    worker_state['args'] = (template, values, dates, image_files, date_range)
+
+
+#
+# Function to render an image in a worker process
+#
+def plot_images_worker(index):
+
+    return plot_images_frame(*worker_state['args'], index)
 
 
 #
@@ -445,6 +799,8 @@ def stitch_animation(
     loop=conf['animation_loops'],
     filepath_dt=None,
     params=None,
+    frames=None,
+    anim_path='export/animation/',
 ):
 
     print("\nStarting to stitch images together for an animation.")
@@ -457,7 +813,7 @@ def stitch_animation(
         filepath_dt = dt.datetime.now()
 
     # Create folder
-    anim_path = pathlib.Path('export/animation/')
+    anim_path = pathlib.Path(anim_path)
     anim_path.mkdir(parents=True, exist_ok=True)
 
     # Force webp format in case images are in webp
@@ -487,45 +843,23 @@ def stitch_animation(
         + animation_format
     )
 
-    images = []
-    image_count = 0
-
-    if animation_format == 'gif':
-        # Loop through image files and add them to 'images'
-        for anim_file_name in file_list:
-            images.append(iio.imread(anim_file_name))
-            image_count += 1
+    # Calculate duration based on the frame rate
+    fps_to_duration = int(round(1 / fps * 1000, 0))
 
-        print("Done. Added", image_count, "images.")
+    print("Create animation.")
 
-        print("Create animation.")
+    # Load and encode one image at a time, so memory use doesn't depend on the number of images
+    # Frames rendered in memory can be passed instead of loading them from the files.
+    if frames is None:
+        frames = animation.file_frames(file_list)
 
-        # Create animation
-        iio.imwrite(anim_path, images, fps=fps, loop=loop)
+    if animation_format == 'gif':
+        animation.write_gif(anim_path, frames, fps_to_duration, loop)
 
     if animation_format == 'webp':
-        # Loop through image files and add them to 'images'
-        for img in file_list:
-            images.append(Image.open(img))
-            image_count += 1
-
-        # Separate the first image to later append the rest
-        img = images[0]
-
-        # Calculate duration based on the frame rate
-        fps_to_duration = int(round(1 / fps * 1000, 0))
-
-        # Create animation
-        img.save(
-            anim_path,
-            save_all=True,
-            append_images=images[1:],
-            duration=fps_to_duration,
-            loop=loop,
-            optimize=False,
-            disposal=2,
-            lossless=True,
-        )
+        animation.write_webp(anim_path, frames, len(file_list), fps_to_duration, loop)
+
+    print("Done. Added", len(file_list), "images.")
 
     print("Animation saved to", anim_path)
 
@@ -535,14 +869,16 @@ def stitch_animation(
 #
 def plot_html(df, df_raw):
 
+    if conf['html_format'] in ['compact', 'chunked']:
+        return plot_html_compact(df, df_raw)
+
     print("\nConvert date to string for slider")
 
     # Convert date to string for the slider
     df['date_str'] = df['date'].apply(lambda x: str(x)[0:10])
 
-    # Calculate quintiles for the colorscale using whole or reduced dataframe
-    df_breaks = df if conf['colorscale'] == 'sample' else df_raw
-    breaks = calc_quantiles(df_breaks, conf['metric'])
+    # Get break points for the colorscale using whole or reduced dataframe
+    breaks, _, zmax = plot_breaks(df, df_raw)
 
     # Get zoom factor for the map
     zoom = misc.calc_zoom()
@@ -552,8 +888,8 @@ def plot_html(df, df_raw):
     # Define variable for script statistics
     dates_processed = len(df['date'].unique())
 
-    # Get GeoJSON data
-    geo_nuts_level3, geo_countries = import_geojson()
+    # Get GeoJSON data of the NUTS regions in the data (not simplified, as the map can be zoomed)
+    geo_nuts_level3, geo_countries = import_geojson(df['nuts_id'].unique())
 
     # Start plotting
     fig = px.choropleth_mapbox(
@@ -561,7 +897,7 @@ def plot_html(df, df_raw):
         locations='nuts_id',
         geojson=geo_nuts_level3,
         color=conf['metric'],
-        range_color=[0, df_breaks[conf['metric']].max()],
+        range_color=[0, zmax],
         color_continuous_scale=[
             [0, conf['colors'][0]],
             [breaks[0.2], conf['colors'][1]],
@@ -615,6 +951,88 @@ def plot_html(df, df_raw):
     # Save output as HTML
     fig.write_html(file)
 
-    print("Output saved to", file)
+    print(f"Output saved to {file} ({html_size(file)})")
 
     return dates_processed
+
+
+#
+# Function to create a compact HTML animation
+# The map (including the geometry) is embedded once and the values of all frames as one typed array
+# (see player.py). A small script swaps the colors of the map and the date for each frame.
+# With conf['html_format'] 'chunked', the values are saved to files with one chunk of dates each
+# instead, which are loaded by the script as needed (served by any static file server).
+#
+def plot_html_compact(df, df_raw):
+
+    # Pivot the metric to one row of values per date and one column per NUTS region
+    dates, nuts_ids, values = frames_matrix(df)
+
+    # Construct the map with the values of the first date (not simplified, as the map can be zoomed)
+    fig = plot_base_figure(df, df_raw, nuts_ids, values[0], simplify=False)
+
+    breaks, _, zmax = plot_breaks(df, df_raw)
+    encoding = conf['html_encoding']
+
+    # Values encoded as levels of the colorscale are shown on a colorscale with evenly spaced colors
+    if encoding == 'uint8':
+        fig.update_traces(
+            z=player.player_levels(values[0], breaks, zmax),
+            zmin=0,
+            zmax=255,
+            colorscale=player.player_colorscale_levels(conf['colors']),
+        )
+
+    # Get min and max dates of the whole dataset to position the date annotation
+    date_range = (df_raw['date'].min(), df_raw['date'].max())
+
+    # Define path and file name for export
+    # Chunked exports are saved as folder with the page, plotly.js and the files of the frames.
+    filepath = 'export/html/' + dt.datetime.now().strftime('%Y%m%d-%H%M%S')
+
+    if conf['html_format'] == 'chunked':
+        export_path = pathlib.Path(filepath)
+        file = str(export_path / 'index.html')
+        chunks = player.player_files(
+            export_path, values, dates, breaks, zmax, encoding, conf['html_chunk']
+        )
+    else:
+        export_path = pathlib.Path(filepath).parent
+        file = filepath + '-compact.html'
+        chunks = player.player_embedded(values, breaks, zmax, encoding)
+
+    export_path.mkdir(parents=True, exist_ok=True)
+
+    script = player.player_script(
+        chunks,
+        len(nuts_ids),
+        [date_text(date) for date in dates],
+        [date_y(date, date_range) for date in dates],
+        encoding,
+        conf['animation_fps'],
+        conf['width'],
+    )
+
+    print("\nStart plotting.")
+
+    # Save output as HTML
+    fig.write_html(
+        file,
+        post_script=script,
+        include_plotlyjs='directory' if conf['html_format'] == 'chunked' else True,
+    )
+
+    print(f"Output saved to {file} ({html_size(file)})")
+
+    if conf['html_format'] == 'chunked':
+        print(f"{len(chunks)} files with the frames saved to {export_path / 'frames'}")
+
+    return len(dates)
+
+
+#
+# Function to get the size of an exported HTML file as text
+#
+def html_size(file):
+
+    return f"{round(pathlib.Path(file).stat().st_size / 1024 ** 2, 1)} MB"
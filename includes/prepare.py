@@ -1,29 +1,45 @@
+import json
+import pathlib
+import re
+
+import numpy as np
 import pandas as pd
-import requests
 
+import includes.download as download
+import includes.profiler as profiler
 from settings import conf  # Import configuration defined in settings.py
 
+# Compact types of the imported columns: categories for ids and names, float32 for numbers
+# (float32 holds integers like population and case counts exactly up to 16.7 million)
+SCHEMA = {
+    'country': 'category',
+    'nuts_id': 'category',
+    'nuts_name': 'category',
+    'population': 'float32',
+    'cases': 'float32',
+}
+
+# Types of the imported columns with data_schema 'untyped' (text and double precision, e.g. to measure
+# the memory saved by the compact types)
+SCHEMA_UNTYPED = {
+    'country': 'str',
+    'nuts_id': 'str',
+    'nuts_name': 'str',
+    'population': 'float64',
+    'cases': 'float64',
+}
+
 
 #
 # Function to get COVID-19 data
 #
 def import_data():
 
-    print("Get COVID-19 data. This may take a while.")
-
-    # If settings say so, refresh the data source
-    if not conf['refresh_source']:
-        print(
-            "Skipping external refresh of the data. (To change this, adjust 'refresh_source' setting.)"
-        )
-    else:
-        import_refresh_source()
-
-    print("Start data import.")
+    print("Start data import. This may take a while.")
 
     # Import CSV with COVID-19 data
     covid_raw = pd.read_csv(
-        'data/european-regional-tracker.csv',
+        conf['source_file'],
         sep=';',
         decimal='.',
         parse_dates=['date'],
@@ -35,6 +51,7 @@ def import_data():
             'population',
             'cases_daily',
         ],
+        dtype={**schema_types(), 'cases_daily': schema_types()['cases']},
         header=0,
     )
 
@@ -64,8 +81,58 @@ def import_data():
     return covid_raw
 
 
+#
+# Function to get the COVID-19 source data
+# Returns a fingerprint of the source file and the settings the prepared data depends on.
+#
+def import_source():
+
+    print("Get COVID-19 data.")
+
+    # If settings say so, refresh the data source
+    if not conf['refresh_source']:
+        print(
+            "Skipping external refresh of the data. (To change this, adjust 'refresh_source' setting.)"
+        )
+        source_hash = download.file_hash(conf['source_file'])
+    else:
+        source_hash = import_refresh_source()
+
+    fingerprint = {
+        'source_sha256': source_hash,
+        'update_incremental': conf['update_incremental'],
+        **prepared_settings(),
+    }
+
+    return fingerprint
+
+
+#
+# Function to get the settings the prepared data depends on
+#
+def prepared_settings():
+
+    return {
+        **{
+            key: conf[key]
+            for key in [
+                'limit_dates',
+                'data_start',
+                'data_end',
+                'outlier_window',
+                'outlier_min_periods',
+                'outlier_sigma',
+                'outlier_min_cases',
+                'data_schema',
+            ]
+        },
+        'metrics': list(conf['metric_desc']),
+    }
+
+
 #
 # Function to refresh COVID-19 data from source
+# The file is only downloaded if it changed since the last download.
 #
 def import_refresh_source():
 
@@ -73,20 +140,110 @@ def import_refresh_source():
 
     # COVID19-European-Regional-Tracker
     # https://github.com/asjadnaqvi/COVID19-European-Regional-Tracker
-    remote_url = (
-        'https://raw.githubusercontent.com/asjadnaqvi/COVID19-European-Regional-Tracker/master/04_master'
-        '/csv_nuts/EUROPE_COVID19_master.csv'
+    state = download.download_file(conf['source_url'], conf['source_file'])
+
+    if not state['changed']:
+        print(f"Done. Source data unchanged, keeping {conf['source_file']}")
+    else:
+        print(f"Done. File saved as {conf['source_file']} (SHA-256 {state['sha256']})")
+
+    return state['sha256']
+
+
+#
+# Functions to check if the prepared data was created from the same source data and settings
+#
+def prepared_unchanged(fingerprint):
+
+    file = pathlib.Path(export_file(extension='json', name='covid-waves-source'))
+    files = [
+        export_file(suffix, extension)
+        for suffix in ['', '-weekly']
+        for extension in {'csv', conf['data_format']}
+    ]
+
+    if fingerprint['source_sha256'] is None or not file.exists():
+        return False
+
+    if not all(pathlib.Path(file).exists() for file in files):
+        return False
+
+    with open(file) as source_file:
+        return json.load(source_file) == fingerprint
+
+
+def save_prepared_fingerprint(fingerprint):
+
+    with open(export_file(extension='json', name='covid-waves-source'), 'w') as file:
+        json.dump(fingerprint, file, indent=2)
+
+
+#
+# Function to remove categories no longer used in the categorical columns of a dataframe
+#
+def schema_remove_unused(covid_data):
+
+    for column in covid_data.columns:
+        if isinstance(covid_data[column].dtype, pd.CategoricalDtype):
+            covid_data = covid_data.assign(
+                **{column: covid_data[column].cat.remove_unused_categories()}
+            )
+
+    return covid_data
+
+
+#
+# Functions to get the types of the imported columns and of calculated values (see conf['data_schema'])
+#
+def schema_types():
+
+    return SCHEMA if conf['data_schema'] == 'compact' else SCHEMA_UNTYPED
+
+
+def schema_float():
+
+    return np.float32 if conf['data_schema'] == 'compact' else np.float64
+
+
+#
+# Function to apply the compact types to a dataframe of imported or prepared data
+# (e.g. after combining it from parts with different categories or read without types)
+# Moving averages and cases (per population) are float32, cumulated values keep double precision.
+#
+def schema_apply(covid_data):
+
+    types = {
+        **schema_types(),
+        **dict.fromkeys(['cases_pop', 'cases_w', 'cases_pop_w'], schema_float()),
+        **dict.fromkeys(
+            [*moving_windows('daily'), *moving_windows('weekly')], schema_float()
+        ),
+    }
+    types.pop('population')
+
+    covid_data = covid_data.astype(
+        {column: dtype for column, dtype in types.items() if column in covid_data}
     )
-    local_file = 'data/european-regional-tracker.csv'
 
-    # Make http request for remote file data
-    data = requests.get(remote_url)
+    if 'population' in covid_data:
+        covid_data['population'] = schema_population(covid_data['population'])
+
+    return covid_data
+
+
+#
+# Function to get the population as int32 if it is known for all rows (and fits), otherwise as float32
+# (float64 without the compact types)
+#
+def schema_population(population):
+
+    if conf['data_schema'] != 'compact':
+        return population.astype(np.float64)
 
-    # Save file data to local copy
-    with open(local_file, 'wb') as file:
-        file.write(data.content)
+    if population.notna().all() and population.max() < np.iinfo(np.int32).max:
+        return population.astype(np.int32)
 
-    print(f"Done. File saved as {local_file}")
+    return population.astype(np.float32)
 
 
 #
@@ -98,11 +255,8 @@ def clean_data(covid_raw):
 
     print("\nDo some cleaning.")
 
-    # Make a copy of the dataframe
-    covid_clean = covid_raw.copy()
-
-    # Remove negative values
-    covid_clean = clean_remove_neg(covid_clean)
+    # Remove negative values (the stages return new dataframes, so the imported one is not changed)
+    covid_clean = clean_remove_neg(covid_raw)
 
     # Remove NUTS regions irrelevant to the map
     covid_clean = clean_remove_nuts(covid_clean)
@@ -162,6 +316,9 @@ def clean_remove_nuts(covid_clean):
     ]
     covid_clean = covid_clean[~covid_clean['nuts_id'].isin(remove_nuts)]
 
+    # Forget the removed NUTS regions in categorical columns
+    covid_clean = schema_remove_unused(covid_clean)
+
     print(f"Removed {len(remove_nuts)} NUTS regions, leaving {len(covid_clean)} rows.")
 
     return covid_clean
@@ -176,31 +333,119 @@ def clean_outliers(covid_clean):
 
     print("\nRemove extreme outliers for each NUTS group.")
 
-    df_out = covid_clean.copy()
-
-    # Calculate cases per population and exclude values below zero
-    df_out['cases_pop'] = df_out['cases'] / df_out['population'] * 10000
-    df_out = df_out[df_out['cases_pop'] >= 0]
-
-    # Define outliers in a new column
-    # (1) First create a new column grouping by NUTS and working on cases_pop.
-    # (2) Then calculate the difference of each days' value to the mean of a rolling window of 45 days before and after
-    #     that date. That way we get outliers in that timeframe.
-    # (3) Lastly exclude all rows whose calculated value is more than five times the standard deviation for that
-    #     timeframe, i.e. we only catch extreme outliers.
-    df_out['is_outlier'] = df_out.groupby('nuts_id')['cases_pop'].transform(
-        lambda x: (x - x.rolling(120, min_periods=15, center=True).mean()).abs()
-        > 5 * x.rolling(120, min_periods=15, center=True).std()
+    is_outlier = outlier_mask(covid_clean)
+
+    covid_clean = covid_clean[~is_outlier]
+
+    print(
+        f"Removed {is_outlier.sum()} extreme outliers leaving {len(covid_clean)} rows."
     )
 
-    # Include only outlier rows with more than 100 cases per million population
-    df_out = df_out[df_out['is_outlier'] & (df_out['cases_pop'] >= 100)]
+    return covid_clean
 
-    covid_clean = covid_clean[~covid_clean.index.isin(df_out.index)]
 
-    print(f"Removed {len(df_out)} extreme outliers leaving {len(covid_clean)} rows.")
+#
+# Function to mark the extreme outliers in each NUTS id group
+#
 
-    return covid_clean
+
+def outlier_mask(covid_clean):
+
+    # Calculate cases per population (in double precision) and exclude values below zero
+    cases_pop = (
+        covid_clean['cases'].to_numpy(dtype=float)
+        / covid_clean['population'].to_numpy(dtype=float)
+        * 10000
+    )
+    valid = cases_pop >= 0
+
+    # Define outliers
+    # (1) First group by NUTS (keeping the order of the rows) and work on cases_pop.
+    # (2) Then calculate the difference of each days' value to the mean of a centered rolling window
+    #     (120 days by default). That way we get outliers in that timeframe.
+    # (3) Lastly exclude all rows whose calculated value is more than five times (by default) the standard
+    #     deviation for that timeframe, i.e. we only catch extreme outliers.
+    groups = pd.factorize(covid_clean['nuts_id'].to_numpy()[valid])[0]
+    order = np.argsort(groups, kind='stable')
+    is_outlier = np.zeros(len(covid_clean), dtype=bool)
+    is_outlier[np.flatnonzero(valid)[order]] = rolling_outliers(
+        cases_pop[valid][order],
+        groups[order],
+        window=conf['outlier_window'],
+        min_periods=conf['outlier_min_periods'],
+        sigma=conf['outlier_sigma'],
+    )
+
+    # Include only outlier rows with more than 100 (by default) cases per million population
+    is_outlier &= cases_pop >= conf['outlier_min_cases']
+
+    return is_outlier
+
+
+#
+# Function to arrange values sorted by group in an array of (group, position in group)
+# Shorter groups are padded with missing values at the end. 'cells' gets the values back from the array.
+#
+
+
+def group_array(values, groups):
+
+    group_start = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    group_size = np.diff(np.r_[group_start, len(groups)])
+    position = np.arange(len(groups)) - np.repeat(group_start, group_size)
+    cells = (np.repeat(np.arange(len(group_start)), group_size), position)
+
+    array = np.full((len(group_start), group_size.max()), np.nan)
+    array[cells] = values
+
+    return array, cells
+
+
+#
+# Function to find values deviating from the centered rolling mean of their group by more than
+# sigma times the rolling standard deviation (values have to be sorted by group)
+# Same result as x.rolling(window, min_periods, center=True) with mean() and std() for each group
+#
+
+
+def rolling_outliers(values, groups, window=120, min_periods=15, sigma=5):
+
+    if len(values) == 0:
+        return np.zeros(0, dtype=bool)
+
+    array, cells = group_array(values, groups)
+
+    # Subtract the mean of each group to keep the sums of squares precise
+    known = ~np.isnan(array)
+    array = array - np.nanmean(array, axis=1, keepdims=True)
+    array_zero = np.where(known, array, 0)
+
+    # Prefix sums (starting with 0) of the number of values, the values and their squares
+    def prefix(x):
+        return np.pad(np.cumsum(x, axis=1), ((0, 0), (1, 0)))
+
+    counts, sums, squares = prefix(known), prefix(array_zero), prefix(array_zero**2)
+
+    # Limits of the centered windows, like pandas: (window - 1) // 2 values after each value
+    positions = np.arange(array.shape[1])
+    end = positions + (window - 1) // 2 + 1
+    start = np.maximum(end - window, 0)
+    end = np.minimum(end, array.shape[1])
+
+    count = counts[:, end] - counts[:, start]
+    total = sums[:, end] - sums[:, start]
+    total_squares = squares[:, end] - squares[:, start]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        std = np.sqrt(np.maximum(total_squares - total * mean, 0) / (count - 1))
+
+    # Windows with less than min_periods values don't have a mean and standard deviation
+    std[count < max(min_periods, 2)] = np.nan
+
+    is_outlier = np.abs(array - mean) > sigma * std
+
+    return is_outlier[cells]
 
 
 #
@@ -208,38 +453,42 @@ def clean_outliers(covid_clean):
 #
 
 
-def transform_data(covid_clean):
+def transform_data(covid_clean, seeds=(None, None)):
     print("\nDo some calculations.")
 
-    # Make a copy of the dataframe
-    covid_calc = covid_clean.copy()
-
     # Function to add missing dates for each nuts_id group
-    covid_calc = transform_missing_dates(covid_calc)
+    # (returns a new dataframe, which the following stages change in place)
+    with profiler.profiler_stage('transform_missing_dates'):
+        covid_calc = transform_missing_dates(covid_clean)
 
     # Fill missing values in 'static' columns
-    covid_calc = transform_fill_missing(covid_calc)
+    with profiler.profiler_stage('transform_fill_missing'):
+        covid_calc = transform_fill_missing(covid_calc)
 
     # Interpolate missing values in 'dynamic' columns
-    covid_calc = transform_interpolate(covid_calc)
+    with profiler.profiler_stage('transform_interpolate'):
+        covid_calc = transform_interpolate(covid_calc)
 
     # Calculate cases in relation to population for each NUTS ID
-    covid_calc = transform_calc_pop(covid_calc)
+    with profiler.profiler_stage('transform_calc_pop'):
+        covid_calc = transform_calc_pop(covid_calc)
 
     # "Fork" weekly aggregates before further calculations
-    covid_calc_weekly = transform_fork_weekly(covid_calc)
-
-    # Calculate 7-, 14-, and 28-day moving average for each NUTS ID
-    covid_calc = transform_moving_avg(covid_calc, period='daily')
-    covid_calc_weekly = transform_moving_avg(covid_calc_weekly, period='weekly')
-
-    # Calculate cumulated cases per population for each NUTS ID
-    covid_calc = transform_cumulated(covid_calc, period='daily')
-    covid_calc_weekly = transform_cumulated(covid_calc_weekly, period='weekly')
+    with profiler.profiler_stage('transform_fork_weekly'):
+        covid_calc_weekly = transform_fork_weekly(covid_calc)
+
+    # Calculate moving averages and cumulated cases per population for each NUTS ID
+    # (seeds are cumulated values before the first date, used when updating data incrementally)
+    with profiler.profiler_stage('transform_rolling'):
+        covid_calc = transform_rolling(covid_calc, period='daily', seed=seeds[0])
+        covid_calc_weekly = transform_rolling(
+            covid_calc_weekly, period='weekly', seed=seeds[1]
+        )
 
     # Fill still missing values with a constant for 'no data available'
-    covid_calc = transform_fill_no_data(covid_calc, period='daily')
-    covid_calc_weekly = transform_fill_no_data(covid_calc_weekly, period='weekly')
+    with profiler.profiler_stage('transform_fill_no_data'):
+        covid_calc = transform_fill_no_data(covid_calc, period='daily')
+        covid_calc_weekly = transform_fill_no_data(covid_calc_weekly, period='weekly')
 
     print("\nCalculations done.")
 
@@ -248,7 +497,6 @@ def transform_data(covid_clean):
 
 #
 # Function to add missing dates for each nuts_id group
-# From https://stackoverflow.com/a/62690665
 #
 
 
@@ -260,18 +508,19 @@ def transform_missing_dates(covid_calc):
     date_min = covid_calc['date'].min()
     date_max = covid_calc['date'].max()
 
-    # Fill in missing dates for each group
-    covid_calc = (
-        covid_calc.set_index('date')
-        .groupby('nuts_id')
-        .apply(
-            lambda x: x.reindex(
-                pd.date_range(date_min, date_max, freq='D', name='date')
-            )
-        )
-        .drop('nuts_id', axis=1)
+    # Every combination of NUTS id and date in the whole time frame (keeping the type of the NUTS ids)
+    nuts_ids = covid_calc['nuts_id'].dropna().unique()
+    full_index = pd.MultiIndex.from_product(
+        [
+            pd.Index(nuts_ids, dtype=covid_calc['nuts_id'].dtype).sort_values(),
+            pd.date_range(date_min, date_max, freq='D'),
+        ],
+        names=['nuts_id', 'date'],
     )
 
+    # Fill in missing dates for all groups at once
+    covid_calc = covid_calc.set_index(['nuts_id', 'date']).reindex(full_index)
+
     # Reset index
     covid_calc = covid_calc.reset_index()
 
@@ -295,7 +544,12 @@ def transform_fill_missing(covid_calc):
 
     # Loop through the columns and fill them
     for fill_col in fill:
-        covid_calc[fill_col] = covid_calc.groupby('nuts_id')[fill_col].ffill().bfill()
+        covid_calc[fill_col] = (
+            covid_calc.groupby('nuts_id', observed=True)[fill_col].ffill().bfill()
+        )
+
+    # Population as small integer if it is known for all regions
+    covid_calc['population'] = schema_population(covid_calc['population'])
 
     print("Done.")
 
@@ -304,7 +558,6 @@ def transform_fill_missing(covid_calc):
 
 #
 # Function to interpolate missing values in 'dynamic' columns
-# From https://stackoverflow.com/a/58844499
 #
 
 
@@ -315,17 +568,61 @@ def transform_interpolate(covid_calc):
     # Columns to be interpolated
     interpolate = ['cases']
 
-    # Loop through columns and interpolate missing values
-    for fill_col in interpolate:
-        covid_calc[fill_col] = covid_calc.groupby('nuts_id').apply(
-            lambda x: x[[fill_col]].interpolate(method='linear', limit_area='inside')
-        )
+    # After transform_missing_dates() there is one row for each nuts_id and date, sorted by both.
+    # So the columns can be reshaped to arrays of (column, nuts_id, date) and interpolated all at once.
+    regions = covid_calc['nuts_id'].nunique()
+    values = (
+        covid_calc[interpolate]
+        .to_numpy(dtype=float)
+        .T.reshape(len(interpolate), regions, -1)
+    )
+
+    values = interpolate_inside(values)
+
+    covid_calc[interpolate] = values.reshape(len(interpolate), -1).T.astype(
+        schema_float()
+    )
 
     print("Done.")
 
     return covid_calc
 
 
+#
+# Function to linearly interpolate missing values between known values along the last axis
+# Same result as pandas' interpolate(method='linear', limit_area='inside') for each row
+#
+
+
+def interpolate_inside(values):
+
+    positions = np.arange(values.shape[-1])
+    known = ~np.isnan(values)
+
+    # Position of the previous and the next known value for each position
+    prev_known = np.maximum.accumulate(np.where(known, positions, -1), axis=-1)
+    next_known = np.flip(
+        np.minimum.accumulate(
+            np.flip(np.where(known, positions, values.shape[-1]), axis=-1), axis=-1
+        ),
+        axis=-1,
+    )
+
+    # Only fill gaps with known values on both sides
+    inside = ~known & (prev_known >= 0) & (next_known < values.shape[-1])
+
+    prev_clipped = np.clip(prev_known, 0, values.shape[-1] - 1)
+    next_clipped = np.clip(next_known, 0, values.shape[-1] - 1)
+    prev_value = np.take_along_axis(values, prev_clipped, axis=-1)
+    next_value = np.take_along_axis(values, next_clipped, axis=-1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (next_value - prev_value) / (next_clipped - prev_clipped)
+        interpolated = slope * (positions - prev_clipped) + prev_value
+
+    return np.where(inside, interpolated, values)
+
+
 #
 # Function to calculate cases in relation to population for each NUTS ID
 #
@@ -333,8 +630,12 @@ def transform_calc_pop(covid_calc):
 
     print("\nCalculate cases in relation to population.")
 
-    # Calculation
-    covid_calc['cases_pop'] = covid_calc['cases'] / covid_calc['population'] * 10000
+    # Calculation (in double precision)
+    covid_calc['cases_pop'] = (
+        covid_calc['cases'].to_numpy(dtype=float)
+        / covid_calc['population'].to_numpy(dtype=float)
+        * 10000
+    ).astype(schema_float())
 
     print("Done.")
 
@@ -351,7 +652,8 @@ def transform_fork_weekly(covid_calc):
     # Group by nuts_id and aggregate by week
     covid_calc_weekly = (
         covid_calc.groupby(
-            ['nuts_id', pd.Grouper(key='date', freq='W-MON'), 'country', 'nuts_name']
+            ['nuts_id', pd.Grouper(key='date', freq='W-MON'), 'country', 'nuts_name'],
+            observed=True,
         )[['cases', 'cases_pop']]
         .sum()
         .reset_index()
@@ -369,87 +671,90 @@ def transform_fork_weekly(covid_calc):
 
 
 #
-# Function to Calculate 7-, 14-, and 28-day moving average for each NUTS ID
+# Function to get the moving averages to be calculated from the metrics defined in settings.py
+# E.g. 'moving14d_pop' is a 14-day moving average of daily data, 'moving4w_pop' a 4-week one of weekly data.
 #
-def transform_moving_avg(covid_calc, period='daily'):
-
-    if period == 'daily':
-
-        print("\nCalculate 7/14-day moving average for each NUTS ID.")
-
-        covid_calc['moving7d_pop'] = covid_calc.groupby('nuts_id')[
-            'cases_pop'
-        ].transform(lambda x: x.rolling(7, 1).mean().round(2))
-
-        covid_calc['moving14d_pop'] = covid_calc.groupby('nuts_id')[
-            'cases_pop'
-        ].transform(lambda x: x.rolling(14, 1).mean().round(2))
-
-        covid_calc['moving28d_pop'] = covid_calc.groupby('nuts_id')[
-            'cases_pop'
-        ].transform(lambda x: x.rolling(28, 1).mean().round(2))
-
-        print("Done.")
-
-        return covid_calc
+def moving_windows(period='daily'):
 
-    if period == 'weekly':
+    unit = 'd' if period == 'daily' else 'w'
+    windows = {}
 
-        # Calculate 4- and 8-week moving average for aggregated weekly data
-        print(
-            "\nCalculate 4- and 8-week moving average for each NUTS ID (weekly data)."
-        )
+    for metric in conf['metric_desc']:
+        match = re.fullmatch(r'moving(\d+)' + unit + '_pop', metric)
 
-        covid_calc['moving4w_pop'] = covid_calc.groupby('nuts_id')[
-            'cases_pop_w'
-        ].transform(lambda x: x.rolling(4, 2).mean().round(2))
-        covid_calc['moving8w_pop'] = covid_calc.groupby('nuts_id')[
-            'cases_pop_w'
-        ].transform(lambda x: x.rolling(8, 4).mean().round(2))
+        if match:
+            window = int(match.group(1))
 
-        print("Done.")
+            # Daily values are averaged from the first day, weekly ones need at least half of the window
+            windows[metric] = (window, 1 if period == 'daily' else window // 2)
 
-        return covid_calc
+    return windows
 
 
 #
-# Function to calculate cumulated cases per population for each NUTS ID
+# Function to calculate moving averages and cumulated cases per population for each NUTS ID
+# 'seed' optionally holds the cumulated value before the first row for each NUTS ID.
 #
-def transform_cumulated(covid_calc, period='daily'):
+def transform_rolling(covid_calc, period='daily', seed=None):
+
+    # Columns to be calculated from daily or weekly data
+    column = 'cases_pop' if period == 'daily' else 'cases_pop_w'
+    cumulated = 'cumulated_pop' if period == 'daily' else 'cumulated_pop_w'
+    windows = moving_windows(period)
 
     print(
-        f"\nCalculate cumulated cases per population for each NUTS ID. ({period} data)"
+        f"\nCalculate moving averages ({', '.join(windows)}) and cumulated cases per population "
+        f"for each NUTS ID. ({period} data)"
     )
 
-    if period == 'daily':
-
-        covid_calc['cumulated_pop'] = covid_calc.groupby('nuts_id')[
-            'cases_pop'
-        ].transform(pd.Series.cumsum)
-
-        # Forward fill cumulated values to the end
-        covid_calc['cumulated_pop'] = covid_calc.groupby('nuts_id')[
-            'cumulated_pop'
-        ].ffill()
-
-        print("Done.")
-
-        return covid_calc
-
-    if period == 'weekly':
-
-        covid_calc['cumulated_pop_w'] = covid_calc.groupby('nuts_id')[
-            'cases_pop_w'
-        ].transform(pd.Series.cumsum)
+    # Sort rows by NUTS ID and date and arrange the values in an array of (nuts_id, date)
+    groups, nuts_ids = pd.factorize(covid_calc['nuts_id'], sort=True)
+    order = np.lexsort((covid_calc['date'].to_numpy(), groups))
+    values, cells = group_array(
+        covid_calc[column].to_numpy(dtype=float)[order], groups[order]
+    )
 
-        # Forward fill cumulated values to the end
-        covid_calc['cumulated_pop_w'] = covid_calc.groupby('nuts_id')[
-            'cumulated_pop_w'
-        ].ffill()
+    # Cumulated values before the first row (if any)
+    if seed is None:
+        seed = pd.Series(dtype=float)
+    seed = seed.reindex(nuts_ids).to_numpy(dtype=float)[:, np.newaxis]
+    seed_known = ~np.isnan(seed)
+
+    # Prefix sums of values and of the number of known values for each group (missing values are skipped)
+    known = ~np.isnan(values)
+    sums = np.cumsum(
+        np.hstack([np.where(seed_known, seed, 0), np.where(known, values, 0)]), axis=1
+    )[:, 1:]
+    counts = np.cumsum(known, axis=1) + seed_known
+
+    # Calculate all moving averages from the prefix sums
+    results = {}
+    for metric, (window, min_periods) in windows.items():
+        sums_window = sums.copy()
+        sums_window[:, window:] -= sums[:, :-window]
+        counts_window = counts.copy()
+        counts_window[:, window:] -= counts[:, :-window]
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            results[metric] = np.where(
+                counts_window >= min_periods, sums_window / counts_window, np.nan
+            ).round(2)
+
+    # Cumulated values, forward filled to the end
+    results[cumulated] = np.where(counts > 0, sums, np.nan)
+
+    # Write the results back in the original order of the rows
+    # Moving averages are stored as float32 (compact types), cumulated values keep double precision
+    for metric, result in results.items():
+        column_values = np.empty(
+            len(order), dtype=np.float64 if metric == cumulated else schema_float()
+        )
+        column_values[order] = result[cells]
+        covid_calc[metric] = column_values
 
-        print("Done.")
+    print("Done.")
 
-        return covid_calc
+    return covid_calc
 
 
 #
@@ -467,9 +772,7 @@ def transform_fill_no_data(covid_calc, period='daily'):
         no_data = [
             'cases',
             'cases_pop',
-            'moving7d_pop',
-            'moving14d_pop',
-            'moving28d_pop',
+            *moving_windows('daily'),
             'cumulated_pop',
         ]
 
@@ -487,8 +790,7 @@ def transform_fill_no_data(covid_calc, period='daily'):
         no_data = [
             'cases_w',
             'cases_pop_w',
-            'moving4w_pop',
-            'moving8w_pop',
+            *moving_windows('weekly'),
             'cumulated_pop_w',
         ]
 
@@ -508,22 +810,50 @@ def export_data(covid_calc, filename_suffix='', xls=False):
 
     print("\nStart export.")
 
-    # Define string to be added to file name if data is limited to certain time frame
-    limit = (
-        ('_' + str(conf['data_start']) + '_' + str(conf['data_end']))
-        if conf['limit_dates']
-        else ''
-    )
-
     # Define file name and export data to CSV
-    file = 'data/covid-waves-data-clean' + str(filename_suffix) + limit + '.csv'
+    file = export_file(filename_suffix, 'csv')
     covid_calc.to_csv(file)
     print("File saved as", file)
 
+    # Export data in columnar format for fast import
+    if conf['data_format'] in ['feather', 'parquet']:
+        file = export_file(filename_suffix, conf['data_format'])
+        export_columnar(covid_calc, file)
+        print("File saved as", file)
+
     if xls:
 
         # Define file name and export data to Excel file
-        file = 'data/covid-waves-data-clean' + str(filename_suffix) + limit + '.xlsx'
+        file = export_file(filename_suffix, 'xlsx')
         with pd.ExcelWriter(file) as writer:
             covid_calc.to_excel(writer, sheet_name='Data')
         print("File saved as", file)
+
+
+#
+# Function to export data as Feather or Parquet file
+# Feather files are written uncompressed, so they can be memory-mapped when imported.
+#
+def export_columnar(covid_calc, file):
+
+    covid_calc = covid_calc.reset_index(drop=True)
+
+    if file.endswith('.feather'):
+        covid_calc.to_feather(file, compression='uncompressed')
+    else:
+        covid_calc.to_parquet(file, index=False)
+
+
+#
+# Function to get the name of an export file
+#
+def export_file(filename_suffix='', extension='csv', name='covid-waves-data-clean'):
+
+    # Define string to be added to file name if data is limited to certain time frame
+    limit = (
+        ('_' + str(conf['data_start']) + '_' + str(conf['data_end']))
+        if conf['limit_dates']
+        else ''
+    )
+
+    return 'data/' + name + str(filename_suffix) + limit + '.' + extension
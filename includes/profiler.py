@@ -0,0 +1,326 @@
+import contextlib
+import cProfile
+import itertools
+import json
+import os
+import pathlib
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+from settings import conf  # Import configuration defined in settings.py
+
+# Folder for the traces and cProfile dumps
+PROFILE_PATH = 'export/profile'
+
+# Stages measured in this run (in the order they finished), stages currently running
+# and a counter to number the stages in the order they started
+stages = []
+running = []
+started = itertools.count()
+
+# Seconds between samples of the child processes, and the samples (see sample_children())
+SAMPLE_INTERVAL = 0.2
+sampled = {'lock': threading.Lock(), 'thread': None, 'cpu': {}, 'children_rss': 0}
+
+
+#
+# Function to reset the sampling in forked worker processes (e.g. of a batch), as threads aren't forked
+#
+def sample_reset():
+
+    sampled.update(lock=threading.Lock(), thread=None, cpu={}, children_rss=0)
+
+
+os.register_at_fork(after_in_child=sample_reset)
+
+
+#
+# Function to get the live child processes of this process and their children (e.g. Kaleido, worker processes)
+# Returns the fields of /proc/<pid>/stat after the name of each process (empty if there is no /proc).
+#
+def descendants():
+
+    children = {}
+    for path in pathlib.Path('/proc').glob('[0-9]*'):
+        try:
+            stat = (path / 'stat').read_text()
+        except OSError:
+            continue
+
+        fields = stat[stat.rfind(')') + 2 :].split()
+        children.setdefault(int(fields[1]), []).append((int(path.name), fields))
+
+    processes = {}
+    pending = [os.getpid()]
+    while pending:
+        for pid, fields in children.get(pending.pop(), []):
+            processes[pid] = fields
+            pending.append(pid)
+
+    return processes
+
+
+#
+# Function to sample the CPU time and RSS of the child processes
+# The last CPU time seen of each process (by pid and start time) is kept, as processes like the browser
+# started by Kaleido aren't waited for by their parent, so their CPU time is never added to getrusage().
+#
+def sample_children():
+
+    processes = descendants()
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    ticks = os.sysconf('SC_CLK_TCK')
+
+    with sampled['lock']:
+        for pid, fields in processes.items():
+            # utime and stime (fields 14 and 15 of /proc/<pid>/stat) and start time (field 22)
+            sampled['cpu'][(pid, fields[19])] = (
+                int(fields[11]) + int(fields[12])
+            ) / ticks
+
+        # RSS (field 24) of all child processes at the same time
+        rss = (
+            sum(int(fields[21]) for fields in processes.values()) * page_size / 1024**2
+        )
+        sampled['children_rss'] = max(sampled['children_rss'], rss)
+
+
+def sample_loop():
+
+    while True:
+        sample_children()
+        time.sleep(SAMPLE_INTERVAL)
+
+
+#
+# Function to get the CPU time of this process and its child processes (e.g. Kaleido, worker processes)
+# Without /proc, only finished child processes that were waited for are counted.
+#
+def cpu_time():
+
+    if resource is None:
+        return time.process_time()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    seconds = usage.ru_utime + usage.ru_stime
+
+    if not pathlib.Path('/proc/self/stat').exists():
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return seconds + children.ru_utime + children.ru_stime
+
+    sample_children()
+
+    with sampled['lock']:
+        return seconds + sum(sampled['cpu'].values())
+
+
+#
+# Function to get the peak resident memory (MB) of this process since it started or since it was reset
+# (Linux only, otherwise None)
+#
+def peak_rss():
+
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    return None
+
+
+#
+# Functions to get the peaks of memory since they were reset: memory allocated by Python (tracemalloc, bytes),
+# RSS of this process and RSS of all child processes together (MB, sampled)
+# Returns False from memory_reset() if the RSS peak of this process can't be reset (Linux only).
+#
+def memory_peaks():
+
+    sample_children()
+
+    return {
+        'traced': tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0,
+        'rss': peak_rss() or 0,
+        'children_rss': sampled['children_rss'],
+    }
+
+
+def memory_reset():
+
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+    with sampled['lock']:
+        sampled['children_rss'] = 0
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        return False
+
+    return True
+
+
+#
+# Function to pass the memory peaks of a stage to the enclosing stage, as the peaks are reset for each stage
+#
+def memory_merge(stage, peaks):
+
+    for key, value in peaks.items():
+        stage['peaks'][key] = max(stage['peaks'][key], value)
+
+
+#
+# Context manager to measure a stage of the script: wall time, CPU time (including child processes),
+# peak RSS of this process during the stage, peak RSS of its child processes (e.g. Kaleido, worker processes)
+# during the stage and, if conf['profile_memory'] is set, the peak of memory allocated by Python
+# (tracemalloc) during the stage. Child processes are sampled every SAMPLE_INTERVAL seconds (Linux only).
+# Stages can be nested (e.g. the steps of transform_data). If conf['profile_cprofile'] is set, the
+# outermost stage being profiled is dumped to export/profile/<date and time>/<stage>.prof.
+#
+@contextlib.contextmanager
+def profiler_stage(name):
+
+    if conf['profile_memory'] and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    if sampled['thread'] is None and pathlib.Path('/proc/self/stat').exists():
+        sampled['thread'] = threading.Thread(target=sample_loop, daemon=True)
+        sampled['thread'].start()
+
+    # Pass the memory peaks so far to the enclosing stage and reset them for this stage
+    if running:
+        memory_merge(running[-1], memory_peaks())
+    rss_reset = memory_reset()
+
+    profiler = None
+    if conf['profile_cprofile'] and not any(stage['profiler'] for stage in running):
+        profiler = cProfile.Profile()
+
+    stage = {
+        'name': '/'.join([stage['name'] for stage in running] + [name]),
+        'start': next(started),
+        'profiler': profiler,
+        'peaks': {'traced': 0, 'rss': 0, 'children_rss': 0},
+    }
+    running.append(stage)
+
+    wall_start, cpu_start = time.perf_counter(), cpu_time()
+
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+
+        running.pop()
+
+        memory_merge(stage, memory_peaks())
+        peaks = stage['peaks']
+
+        record = {
+            'stage': stage['name'],
+            'start': stage['start'],
+            'depth': len(running),
+            'wall_s': round(time.perf_counter() - wall_start, 4),
+            'cpu_s': round(cpu_time() - cpu_start, 4),
+            'rss_peak_mb': round(peaks['rss'], 1) if rss_reset else None,
+            'children_rss_peak_mb': (
+                round(peaks['children_rss'], 1) if sampled['thread'] else None
+            ),
+            'traced_peak_mb': None,
+        }
+
+        if tracemalloc.is_tracing():
+            record['traced_peak_mb'] = round(peaks['traced'] / 1024**2, 1)
+
+        if running:
+            memory_merge(running[-1], peaks)
+        memory_reset()
+
+        if profiler is not None:
+            file = profiler_path() / (stage['name'].replace('/', '.') + '.prof')
+            file.parent.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(file)
+            record['cprofile'] = str(file)
+
+        stages.append(record)
+
+
+#
+# Function to get the folder for the cProfile dumps of this run
+#
+def profiler_path():
+
+    return pathlib.Path(PROFILE_PATH) / conf['filepath_dt'].strftime('%Y%m%d-%H%M%S')
+
+
+#
+# Function to print a summary of all stages and the script running time, and save the trace as JSON
+#
+def profiler_report(dates_processed=0):
+
+    total_time = time.time() - conf['start_time']
+
+    # Show the stages in the order they started (nested stages after the stage containing them)
+    trace = sorted(stages, key=lambda record: record['start'])
+
+    # Peaks of memory during each stage: RSS of this process and of its child processes (e.g. Kaleido)
+    print(
+        f"\n{'Stage':<44} {'Wall (s)':>9} {'CPU (s)':>9} {'RSS (MB)':>9} "
+        f"{'Child RSS (MB)':>15} {'Traced (MB)':>12}"
+    )
+
+    for record in trace:
+        name = '  ' * record['depth'] + record['stage'].split('/')[-1]
+        rss, children_rss, traced = [
+            record[key] if record[key] is not None else '-'
+            for key in ['rss_peak_mb', 'children_rss_peak_mb', 'traced_peak_mb']
+        ]
+
+        print(
+            f"{name:<44} {record['wall_s']:>9.2f} {record['cpu_s']:>9.2f} "
+            f"{rss:>9} {children_rss:>15} {traced:>12}"
+        )
+
+    print(
+        f"\nScript running time: {round(total_time, 2)} seconds ({round(total_time / 60, 2)} minutes)"
+    )
+
+    if dates_processed:
+        print(
+            f"{dates_processed} days have been processed. "
+            f"That's {round(total_time / dates_processed, 2)} seconds per day."
+        )
+
+    file = pathlib.Path(PROFILE_PATH) / (
+        conf['filepath_dt'].strftime('%Y%m%d-%H%M%S') + '.json'
+    )
+    file.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(file, 'w') as trace_file:
+        json.dump(
+            {
+                'datetime': conf['filepath_dt'].isoformat(timespec='seconds'),
+                'mode': conf['mode'],
+                'total_s': round(total_time, 4),
+                'dates_processed': dates_processed,
+                'stages': trace,
+            },
+            trace_file,
+            indent=2,
+        )
+
+    print("Trace saved to", file)
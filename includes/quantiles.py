@@ -0,0 +1,139 @@
+import hashlib
+import math
+
+import numpy as np
+
+# Quantiles used as break points for the colorscale
+STEPS = [0, 0.2, 0.4, 0.6, 0.8, 0.9, 0.95, 0.99, 1]
+
+# Number of values added to a t-digest at once
+CHUNK_SIZE = 1_000_000
+
+
+#
+# Function to get the fingerprint of the values of a metric
+#
+def quantiles_fingerprint(values, metric, method):
+
+    fingerprint = hashlib.sha256(f"{metric}-{method}\n".encode('utf-8'))
+    fingerprint.update(np.ascontiguousarray(values).tobytes())
+
+    return fingerprint.hexdigest()
+
+
+#
+# Function to round a break point
+# Low values are rounded to the next integer (method from https://stackoverflow.com/a/2272174),
+# higher values to the next base and very high values to twice the base.
+#
+def quantiles_round(value, base=5):
+
+    if value < (1.5 * base):
+        value = round(value)
+    if (1.5 * base) <= value < (10 * base):
+        value = base * round(value / base)
+    if value >= 10 * base:
+        value = (2 * base) * round(value / (2 * base))
+
+    return value
+
+
+#
+# Function to calculate the break points for the colorscale (normalized to values between 0 and 1)
+# and for the legend (not normalized), as well as the maximum value
+# 'exact' calculates all quantiles at once from the values, 'tdigest' estimates them from a t-digest
+# built chunk by chunk, for data too large to sort in memory. Missing values are ignored.
+#
+def quantiles_breaks(values, method='exact', base=5):
+
+    if method == 'tdigest':
+        digest = tdigest_create()
+        for start in range(0, len(values), CHUNK_SIZE):
+            digest = tdigest_add(digest, values[start : start + CHUNK_SIZE])
+
+        quantiles = tdigest_quantiles(digest, STEPS)
+        zmax = digest['max']
+
+    else:
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+
+        quantiles = np.quantile(values, STEPS)
+        zmax = values.max()
+
+    breaks_legend = {
+        step: quantiles_round(quantile, base)
+        for step, quantile in zip(STEPS, quantiles)
+    }
+    breaks = {step: round(value / zmax, 3) for step, value in breaks_legend.items()}
+
+    return breaks, breaks_legend, zmax
+
+
+#
+# Function to create an empty t-digest: weighted centroids and the exact minimum and maximum
+#
+def tdigest_create(compression=200):
+
+    return {
+        'means': np.empty(0),
+        'weights': np.empty(0),
+        'min': math.inf,
+        'max': -math.inf,
+        'compression': compression,
+    }
+
+
+#
+# Function to add values to a t-digest
+# The values are merged with the centroids and neighbouring centroids are combined, as long as a
+# centroid covers at most one unit of the scale function k1 (small centroids at the tails, larger
+# ones around the median).
+#
+def tdigest_add(digest, values):
+
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+
+    if not len(values):
+        return digest
+
+    means = np.concatenate([digest['means'], values])
+    weights = np.concatenate([digest['weights'], np.ones(len(values))])
+
+    order = np.argsort(means, kind='stable')
+    means, weights = means[order], weights[order]
+
+    # Quantile at the left edge of each centroid and the unit of the scale function it falls into
+    cumulated = np.cumsum(weights)
+    q = (cumulated - weights) / cumulated[-1]
+    k = digest['compression'] / (2 * math.pi) * np.arcsin(2 * q - 1)
+    groups = np.floor(k - k[0]).astype(np.int64)
+
+    weights_merged = np.bincount(groups, weights=weights)
+    keep = weights_merged > 0
+
+    return {
+        **digest,
+        'means': np.bincount(groups, weights=means * weights)[keep]
+        / weights_merged[keep],
+        'weights': weights_merged[keep],
+        'min': min(digest['min'], values.min()),
+        'max': max(digest['max'], values.max()),
+    }
+
+
+#
+# Function to estimate quantiles from a t-digest
+# Interpolates linearly between the centres of the centroids, with the exact minimum and maximum as ends.
+#
+def tdigest_quantiles(digest, steps):
+
+    weights = digest['weights']
+    total = weights.sum()
+    centres = (np.cumsum(weights) - weights / 2) / total
+
+    positions = np.concatenate([[0], centres, [1]])
+    means = np.concatenate([[digest['min']], digest['means'], [digest['max']]])
+
+    return np.interp(steps, positions, means)
@@ -0,0 +1,355 @@
+import io
+
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+import PIL.Image as Image
+import PIL.ImageColor as ImageColor
+import PIL.ImageDraw as ImageDraw
+
+import includes.render as render
+
+# Number of date texts rendered together in one image of the date atlas
+ATLAS_BATCH = 100
+
+
+#
+# Function to prepare the layers of the native renderer from the base figure
+# The static parts of the map are rendered by Kaleido once, the NUTS regions are rasterized to an
+# image of region labels. Each frame is then just a lookup of the region colors (see frame_image()).
+#
+def frame_layers(fig, date_texts):
+
+    width, height = fig.layout.width, fig.layout.height
+
+    # Render the map once with all NUTS regions black and once with all regions white
+    # Each pixel of a frame is then black + coverage * color, with the coverage by NUTS regions
+    # (including anti-aliasing and the country borders drawn on top) taken from the difference.
+    black = render_static(fig, '#000')
+    white = render_static(fig, '#fff')
+    coverage = (white - black) / 255
+
+    trace = fig.data[0]
+
+    layers = {
+        'black': black,
+        'coverage': coverage,
+        'labels': rasterize_labels(fig, trace.locations, coverage),
+        'colorscale': colorscale_arrays(trace.colorscale),
+        'zrange': (trace.zmin, trace.zmax),
+    }
+
+    # Position of the date (paper coordinates within the margins) and attribution
+    date_annotation, attribution = [
+        annotation
+        for name in ['date', 'attribution']
+        for annotation in fig.layout.annotations
+        if annotation.name == name
+    ]
+    margin = fig.layout.margin
+    layers['paper'] = (
+        margin.l,
+        margin.t,
+        width - margin.l - margin.r,
+        height - margin.t - margin.b,
+    )
+    layers.update(date_atlas(fig, date_annotation, date_texts))
+    layers['attribution'] = render_overlay(
+        fig, [go.layout.Annotation(attribution, visible=True)]
+    )
+
+    return layers
+
+
+#
+# Function to render a figure with Kaleido and get the image as array
+#
+def render_image(fig, width, height):
+
+    image = render.frame_scope().render(
+        pio.to_json(fig, validate=False), 'png', width, height
+    )
+
+    return np.asarray(Image.open(io.BytesIO(image)))
+
+
+#
+# Function to render the base figure with all NUTS regions in one color and without the date
+#
+def render_static(fig, color):
+
+    fig_static = go.Figure(fig)
+    fig_static.update_traces(colorscale=[[0, color], [1, color]])
+
+    for annotation in fig_static.layout.annotations:
+        if annotation.name == 'date':
+            annotation.text = ''
+
+    image = render_image(fig_static, fig.layout.width, fig.layout.height)
+
+    return image[:, :, :3].astype(np.float32)
+
+
+#
+# Function to render annotations on a transparent figure with the layout of the base figure
+# Returns the cropped image and its position.
+#
+def render_overlay(fig, annotations):
+
+    fig_overlay = go.Figure(
+        layout=dict(
+            width=fig.layout.width,
+            height=fig.layout.height,
+            margin=fig.layout.margin,
+            template=fig.layout.template,
+            paper_bgcolor='rgba(0,0,0,0)',
+            plot_bgcolor='rgba(0,0,0,0)',
+            xaxis={'visible': False},
+            yaxis={'visible': False},
+            annotations=annotations,
+        )
+    )
+
+    image = render_image(fig_overlay, fig.layout.width, fig.layout.height)
+
+    # Crop to the visible part
+    rows = np.flatnonzero(image[:, :, 3].any(axis=1))
+    columns = np.flatnonzero(image[:, :, 3].any(axis=0))
+
+    if len(rows) == 0:
+        return {'image': np.zeros((0, 0, 4), dtype=np.uint8), 'position': (0, 0)}
+
+    return {
+        'image': image[rows[0] : rows[-1] + 1, columns[0] : columns[-1] + 1],
+        'position': (rows[0], columns[0]),
+    }
+
+
+#
+# Function to render the texts of all dates in batches, stacked in rows of the same height
+# For each date, the part of its row below the anchor of the annotation (yanchor = 'top') is kept.
+#
+def date_atlas(fig, date_annotation, date_texts):
+
+    font_size = date_annotation.font.size or fig.layout.template.layout.font.size
+    row_height = int(np.ceil(font_size * 2))
+    margin = fig.layout.margin
+
+    rows = []
+
+    for batch in range(0, len(date_texts), ATLAS_BATCH):
+        texts = date_texts[batch : batch + ATLAS_BATCH]
+        height = margin.t + margin.b + row_height * len(texts)
+
+        annotations = [
+            go.layout.Annotation(date_annotation, text=text, y=1 - i / len(texts))
+            for i, text in enumerate(texts)
+        ]
+
+        fig_overlay = go.Figure(
+            layout=dict(
+                width=fig.layout.width,
+                height=height,
+                margin=margin,
+                template=fig.layout.template,
+                paper_bgcolor='rgba(0,0,0,0)',
+                plot_bgcolor='rgba(0,0,0,0)',
+                xaxis={'visible': False},
+                yaxis={'visible': False},
+                annotations=annotations,
+            )
+        )
+        image = render_image(fig_overlay, fig.layout.width, height)
+
+        rows.extend(
+            image[margin.t + i * row_height : margin.t + (i + 1) * row_height]
+            for i in range(len(texts))
+        )
+
+    # Keep only the columns containing text and only the alpha channel (the text has one color)
+    rows = np.stack(rows)
+    columns = np.flatnonzero(rows[:, :, :, 3].any(axis=(0, 1)))
+    columns = slice(columns[0], columns[-1] + 1) if len(columns) else slice(0, 0)
+    darkest = np.unravel_index(np.argmax(rows[:, :, :, 3]), rows.shape[:3])
+
+    return {
+        'date_alpha': rows[:, :, columns, 3],
+        'date_color': rows[darkest][:3].astype(np.float32),
+        'date_column': columns.start,
+    }
+
+
+#
+# Function to rasterize the NUTS regions to an image of region labels (index of the location + 1)
+# The projection is the Web Mercator projection of Mapbox with the center and zoom of the map.
+#
+def rasterize_labels(fig, locations, coverage):
+
+    width, height = fig.layout.width, fig.layout.height
+    size = coverage.shape[1], coverage.shape[0]
+    margin = fig.layout.margin
+    mapbox = fig.layout.mapbox
+
+    # Pixels per radian and position of the map center in pixels
+    scale = 512 * 2**mapbox.zoom / (2 * np.pi)
+    center = mercator(np.array([[mapbox.center.lon, mapbox.center.lat]]))[0] * scale
+    offset = np.array(
+        [
+            margin.l + (width - margin.l - margin.r) / 2,
+            margin.t + (height - margin.t - margin.b) / 2,
+        ]
+    )
+
+    labels_by_id = {location: i + 1 for i, location in enumerate(locations)}
+    polygons = []
+
+    for feature in fig.data[0].geojson['features']:
+        label = labels_by_id.get(feature['id'])
+        if label is None:
+            continue
+
+        geometry = feature['geometry']
+        parts = (
+            geometry['coordinates']
+            if geometry['type'] == 'MultiPolygon'
+            else [geometry['coordinates']]
+        )
+
+        # Outer rings only. Holes are filled by the regions inside them, drawn later.
+        for part in parts:
+            points = mercator(np.asarray(part[0], dtype=np.float64)) * scale - center
+            points[:, 1] *= -1
+            points += offset
+            area = np.abs(
+                np.sum(points[:-1, 0] * points[1:, 1] - points[1:, 0] * points[:-1, 1])
+            )
+            polygons.append((area, label, points))
+
+    # Draw larger polygons first, so regions surrounded by others stay visible
+    labels = Image.new('I', size, 0)
+    draw = ImageDraw.Draw(labels)
+
+    for _, label, points in sorted(polygons, key=lambda polygon: -polygon[0]):
+        draw.polygon([tuple(point) for point in points], fill=label)
+
+    labels = np.array(labels, dtype=np.int32)
+
+    # Assign pixels at the edges covered by a region (anti-aliasing) to a neighbouring region
+    covered = coverage.max(axis=2) > 0.01
+    for _ in range(3):
+        missing = covered & (labels == 0)
+        if not missing.any():
+            break
+
+        for shift in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
+            neighbour = np.roll(labels, shift, axis=(0, 1))
+            fill = missing & (labels == 0) & (neighbour > 0)
+            labels[fill] = neighbour[fill]
+
+    return labels
+
+
+#
+# Function to project longitude and latitude (degrees) to Web Mercator (radians)
+#
+def mercator(coordinates):
+
+    projected = np.radians(coordinates)
+    projected[:, 1] = np.log(np.tan(np.pi / 4 + projected[:, 1] / 2))
+
+    return projected
+
+
+#
+# Function to get the positions and RGB colors of a colorscale as arrays
+#
+def colorscale_arrays(colorscale):
+
+    positions = np.array([position for position, _ in colorscale], dtype=np.float64)
+    colors = np.array(
+        [ImageColor.getrgb(color)[:3] for _, color in colorscale], dtype=np.float64
+    )
+
+    return positions, colors
+
+
+#
+# Function to get the colors of values as Plotly does (linear interpolation between the colors of
+# the colorscale, values outside of the range getting the first or the last color)
+#
+def value_colors(values, colorscale, zrange):
+
+    positions, colors = colorscale
+    zmin, zmax = zrange
+    normalized = np.clip((values - zmin) / (zmax - zmin), 0, 1)
+
+    rgb = np.stack(
+        [np.interp(normalized, positions, colors[:, channel]) for channel in range(3)],
+        axis=1,
+    )
+
+    return np.round(rgb).astype(np.float32)
+
+
+#
+# Function to composite a frame from the layers, the values of the NUTS regions and the date
+#
+def frame_image(layers, z, date_index, date_y, attribution=False):
+
+    # Color of each pixel from its region label (label 0 for pixels without region)
+    palette = np.zeros((len(z) + 1, 3), dtype=np.float32)
+    palette[1:] = value_colors(np.asarray(z), layers['colorscale'], layers['zrange'])
+
+    frame = layers['black'] + layers['coverage'] * palette[layers['labels']]
+
+    # Date text at its current position
+    # (rendered with the same horizontal position, only the vertical position changes)
+    _, top, _, paper_height = layers['paper']
+    row = int(round(top + (1 - date_y) * paper_height))
+    blend(
+        frame,
+        layers['date_alpha'][date_index],
+        layers['date_color'],
+        row,
+        layers['date_column'],
+    )
+
+    # Attribution in the last frame
+    if attribution:
+        overlay = layers['attribution']
+        image = overlay['image']
+        blend(frame, image[:, :, 3], image[:, :, :3], *overlay['position'])
+
+    return np.round(frame).astype(np.uint8)
+
+
+#
+# Function to blend a color or an image with the given alpha channel onto a frame in place
+#
+def blend(frame, alpha, color, row, column):
+
+    # Clip to the frame
+    height, width = alpha.shape
+    top, left = max(row, 0), max(column, 0)
+    bottom = min(row + height, frame.shape[0])
+    right = min(column + width, frame.shape[1])
+
+    if bottom <= top or right <= left:
+        return
+
+    alpha = alpha[top - row : bottom - row, left - column : right - column]
+    alpha = alpha[:, :, None].astype(np.float32) / 255
+
+    if np.ndim(color) == 3:
+        color = color[top - row : bottom - row, left - column : right - column]
+
+    target = frame[top:bottom, left:right]
+    target += alpha * (color - target)
+
+
+#
+# Function to write a frame composited from the layers to an image file
+#
+def write_frame(image, file, image_format):
+
+    Image.fromarray(image).save(file, format=image_format)
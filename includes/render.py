@@ -0,0 +1,108 @@
+import base64
+import json
+import os
+import re
+
+import plotly.io as pio
+from kaleido.scopes.plotly import PlotlyScope
+
+# Placeholders marking the values in the serialized figure that change from frame to frame
+FRAME_PLACEHOLDER = re.compile(r'"__frame_(\w+)__"')
+
+
+#
+# Kaleido scope accepting a figure that has already been serialized to JSON
+#
+class FrameScope(PlotlyScope):
+    def _json_dumps(self, val):
+
+        # Serialize the export arguments and append the figure JSON as is
+        figure_json = val.pop('data')
+
+        return json.dumps(val)[:-1] + ', "data": ' + figure_json + '}'
+
+    def render(self, figure_json, image_format, width, height, scale=1):
+
+        response = self._perform_transform(
+            figure_json, format=image_format, width=width, height=height, scale=scale
+        )
+
+        # Check for errors reported by Kaleido
+        code = response.get('code', 0)
+        if code != 0:
+            raise ValueError(
+                f"Transform failed with error code {code}: {response.get('message')}"
+            )
+
+        return base64.b64decode(response.get('result').encode('utf-8'))
+
+
+# Kaleido scopes by process id, so each worker process starts its own Kaleido instance
+scopes = {}
+
+
+#
+# Function to get the Kaleido scope of the current process
+#
+def frame_scope():
+
+    pid = os.getpid()
+
+    if pid not in scopes:
+        # Use the same plotly.js and MathJax as plotly's own scope
+        scopes[pid] = FrameScope(
+            plotlyjs=pio.kaleido.scope.plotlyjs,
+            mathjax=pio.kaleido.scope.mathjax,
+        )
+
+    return scopes[pid]
+
+
+#
+# Function to serialize the static figure once, leaving placeholders for the values of each frame
+#
+def frame_template(fig):
+
+    fig_dict = fig.to_dict()
+
+    # Colors of the map
+    fig_dict['data'][0]['z'] = '__frame_z__'
+
+    for annotation in fig_dict['layout']['annotations']:
+        # Text and position of the current date
+        if annotation.get('name') == 'date':
+            annotation['text'] = '__frame_date_text__'
+            annotation['y'] = '__frame_date_y__'
+
+        # Attribution only shown in the last frame
+        if annotation.get('name') == 'attribution':
+            annotation['visible'] = '__frame_attribution__'
+
+    # Split JSON into static parts (even positions) and placeholder names (odd positions)
+    return FRAME_PLACEHOLDER.split(pio.to_json(fig_dict, validate=False))
+
+
+#
+# Function to get the JSON of a single frame by injecting its values into the template
+#
+def frame_json(template, z, date_text, date_y, attribution=False):
+
+    values = {
+        'z': pio.json.to_json_plotly(z),
+        'date_text': json.dumps(date_text),
+        'date_y': json.dumps(date_y),
+        'attribution': json.dumps(attribution),
+    }
+
+    parts = template.copy()
+    parts[1::2] = [values[name] for name in template[1::2]]
+
+    return ''.join(parts)
+
+
+#
+# Function to render the JSON of a frame to an encoded image
+#
+def render_frame(figure_json, image_format, width, height):
+
+    return frame_scope().render(figure_json, image_format, width, height)
@@ -0,0 +1,179 @@
+import collections
+import contextlib
+import json
+import os
+import pathlib
+import time
+
+import numpy as np
+
+# Folder for the logs of the rendered frames
+TELEMETRY_PATH = 'export/telemetry'
+
+# Number of recent frames used for the frames per second
+RATE_WINDOW = 20
+
+
+#
+# Context manager to measure a phase of rendering a frame, adding its duration to phases
+#
+@contextlib.contextmanager
+def phase(phases, name):
+
+    time_start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        phases[name] = phases.get(name, 0) + time.perf_counter() - time_start
+
+
+#
+# Function to start the telemetry of a rendering job
+# job: settings of the job (e.g. resolution, metric, width and image format), run: date and time of the run
+# Each frame is logged as JSON line to export/telemetry/<run>-<job>.jsonl if log is set. If textfile_path
+# is set, the metrics are written to a Prometheus textfile <job>.prom in that folder (e.g. for the textfile
+# collector of node_exporter), one file per job, so jobs rendered at the same time don't replace each other.
+#
+def telemetry_start(job, run, frames_total, frames_done=0, log=True, textfile_path=''):
+
+    log_file = None
+    if log:
+        log_path = pathlib.Path(TELEMETRY_PATH) / (run + '-' + job + '.jsonl')
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        log_file = open(log_path, 'a')
+
+    textfile = ''
+    if textfile_path:
+        textfile = str(pathlib.Path(textfile_path) / ('covid_waves_' + job + '.prom'))
+
+    return {
+        'name': job,
+        'frames_total': frames_total,
+        'frames_done': frames_done,
+        'latencies': [],
+        'phases': collections.Counter(),
+        'arrivals': collections.deque(maxlen=RATE_WINDOW),
+        'time_start': time.perf_counter(),
+        'log_file': log_file,
+        'textfile': textfile,
+    }
+
+
+#
+# Function to record a rendered frame: its phases (in seconds) and when it arrived
+#
+def telemetry_frame(stats, phases):
+
+    stats['frames_done'] += 1
+    stats['latencies'].append(sum(phases.values()))
+    stats['phases'].update(phases)
+    stats['arrivals'].append(time.perf_counter())
+
+
+#
+# Function to get the current metrics: frames per second (of recent frames) and frame latency percentiles
+#
+def telemetry_metrics(stats):
+
+    arrivals = stats['arrivals']
+    fps = 0
+    if len(arrivals) > 1 and arrivals[-1] > arrivals[0]:
+        fps = (len(arrivals) - 1) / (arrivals[-1] - arrivals[0])
+
+    p50, p95 = (
+        np.percentile(stats['latencies'], [50, 95]) if stats['latencies'] else (0, 0)
+    )
+
+    return {'fps': fps, 'p50': p50, 'p95': p95}
+
+
+#
+# Function to log a frame after all of its phases were measured (including adding it to the animation)
+#
+def telemetry_log(stats, index, file, phases):
+
+    metrics = telemetry_metrics(stats)
+
+    if stats['log_file'] is not None:
+        entry = {
+            'time': time.time(),
+            'index': index,
+            'file': file,
+            'phases': {key: round(value, 4) for key, value in phases.items()},
+            'total': round(sum(phases.values()), 4),
+            **{key: round(value, 4) for key, value in metrics.items()},
+        }
+        stats['log_file'].write(json.dumps(entry) + '\n')
+        stats['log_file'].flush()
+
+    if stats['textfile']:
+        telemetry_textfile(stats, metrics)
+
+
+#
+# Function to write the metrics to a Prometheus textfile
+# The file is replaced at once, so it is never read half-written.
+#
+def telemetry_textfile(stats, metrics):
+
+    job = stats['name']
+    lines = [
+        '# HELP covid_waves_frames_rendered Frames rendered by the job.',
+        '# TYPE covid_waves_frames_rendered gauge',
+        f'covid_waves_frames_rendered{{job="{job}"}} {stats["frames_done"]}',
+        '# HELP covid_waves_frames_total Frames of the job.',
+        '# TYPE covid_waves_frames_total gauge',
+        f'covid_waves_frames_total{{job="{job}"}} {stats["frames_total"]}',
+        '# HELP covid_waves_frames_per_second Frames per second (recent frames).',
+        '# TYPE covid_waves_frames_per_second gauge',
+        f'covid_waves_frames_per_second{{job="{job}"}} {metrics["fps"]:.4f}',
+        '# HELP covid_waves_frame_latency_seconds Time to render a frame.',
+        '# TYPE covid_waves_frame_latency_seconds gauge',
+        f'covid_waves_frame_latency_seconds{{job="{job}",quantile="0.5"}} {metrics["p50"]:.4f}',
+        f'covid_waves_frame_latency_seconds{{job="{job}",quantile="0.95"}} {metrics["p95"]:.4f}',
+        '# HELP covid_waves_frame_phase_seconds_total Time spent in each phase of rendering frames.',
+        '# TYPE covid_waves_frame_phase_seconds_total counter',
+        *[
+            f'covid_waves_frame_phase_seconds_total{{job="{job}",phase="{name}"}} {seconds:.4f}'
+            for name, seconds in stats['phases'].items()
+        ],
+    ]
+
+    path = pathlib.Path(stats['textfile'])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(path.name + '.tmp')
+
+    with open(temp_path, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+
+    os.replace(temp_path, path)
+
+
+#
+# Function to print a summary of the rendered frames and close the log
+#
+def telemetry_summary(stats):
+
+    if stats['log_file'] is not None:
+        stats['log_file'].close()
+
+    frames = len(stats['latencies'])
+    if not frames:
+        return
+
+    duration = time.perf_counter() - stats['time_start']
+    metrics = telemetry_metrics(stats)
+    total = sum(stats['phases'].values())
+
+    print(
+        f"\nRendered {frames} frames in {round(duration, 1)} seconds "
+        f"({round(frames / duration, 2)} frames per second). Frame latency: "
+        f"p50 {round(metrics['p50'], 3)} s, p95 {round(metrics['p95'], 3)} s."
+    )
+
+    for name, seconds in stats['phases'].most_common():
+        print(
+            f"  {name:<16} {seconds / frames:>8.3f} s per frame "
+            f"({round(seconds / total * 100, 1) if total else 0}%)"
+        )
@@ -1,44 +1,82 @@
+import includes.batch as batch
+import includes.incremental as incremental
 import includes.prepare as prep
 import includes.plot as plot
 import includes.misc as misc
+import includes.profiler as profiler
 
 
 def main():
     # Get configuration information
     conf = misc.conf_defaults()
 
+    # Start performance measures (including the data update)
+    conf = misc.conf_performance(conf)
+
     # Update data if requested
     if conf['update_data']:
 
-        # Import data
-        covid_raw = prep.import_data()
-
-        # Clean the imported data
-        covid_clean = prep.clean_data(covid_raw)
-
-        # Transform the data
-        covid_calc, covid_calc_weekly = prep.transform_data(covid_clean)
-
-        # Export data
-        prep.export_data(covid_calc)
-        prep.export_data(covid_calc_weekly, filename_suffix='-weekly', xls=True)
-
-    # Start performance measures
-    conf = misc.conf_performance(conf)
+        # Refresh source data if requested
+        with profiler.profiler_stage('import_source'):
+            fingerprint = prep.import_source()
+
+        # Skip the update if the data was already prepared from the same source data and settings
+        if prep.prepared_unchanged(fingerprint):
+            print("\nSource data and settings unchanged. Skipping data update.")
+
+        else:
+            # Import data
+            with profiler.profiler_stage('import_data'):
+                covid_raw = prep.import_data()
+
+            if conf['update_incremental']:
+                # Only recalculate data depending on new or changed source data
+                with profiler.profiler_stage('update_incremental'):
+                    covid_calc, covid_calc_weekly = incremental.update_incremental(
+                        covid_raw
+                    )
+
+            else:
+                # Clean the imported data
+                with profiler.profiler_stage('clean_data'):
+                    covid_clean = prep.clean_data(covid_raw)
+
+                # Transform the data
+                with profiler.profiler_stage('transform_data'):
+                    covid_calc, covid_calc_weekly = prep.transform_data(covid_clean)
+
+                # The checkpoint of an earlier incremental update doesn't match the new data
+                incremental.remove_checkpoint()
+
+            # Export data
+            with profiler.profiler_stage('export_data'):
+                prep.export_data(covid_calc)
+                prep.export_data(covid_calc_weekly, filename_suffix='-weekly', xls=True)
+            prep.save_prepared_fingerprint(fingerprint)
+
+    # Render all jobs of a batch if defined
+    if conf['mode'] == 'image' and conf['jobs']:
+        with profiler.profiler_stage('batch_run'):
+            conf['dates_processed'] = batch.batch_run(conf['jobs'], conf['filepath_dt'])
 
     # Import data if mode is 'image' or 'html'
-    if conf['mode'] in ['image', 'html']:
+    elif conf['mode'] in ['image', 'html']:
 
         # Import COVID-19 data from CSV
-        df, df_raw = plot.import_covid_data()
+        with profiler.profiler_stage('import_covid_data'):
+            df, df_raw = plot.import_covid_data()
 
         # Export maps as images if selected mode is 'image'
         if conf['mode'] == 'image':
-            conf['dates_processed'] = plot.plot_images(df, df_raw, conf['filepath_dt'])
+            with profiler.profiler_stage('plot_images'):
+                conf['dates_processed'] = plot.plot_images(
+                    df, df_raw, conf['filepath_dt']
+                )
 
         # Create HTML animation if selected mode is HTML
         if conf['mode'] == 'html':
-            conf['dates_processed'] = plot.plot_html(df, df_raw)
+            with profiler.profiler_stage('plot_html'):
+                conf['dates_processed'] = plot.plot_html(df, df_raw)
 
     # If selected, create animation from files in manually defined directory
     if conf['mode'] == 'stitch':
@@ -47,10 +85,11 @@ def main():
         image_files = plot.animation_prepare_list()
 
         # Create animation
-        plot.stitch_animation(image_files, filepath_dt=conf['filepath_dt'])
+        with profiler.profiler_stage('stitch_animation'):
+            plot.stitch_animation(image_files, filepath_dt=conf['filepath_dt'])
 
-    # Display statistics of script running time
-    misc.performance_show()
+    # Display running time, CPU time and memory of each stage and save them as trace
+    profiler.profiler_report(conf['dates_processed'])
 
 
 if __name__ == "__main__":
@@ -8,6 +8,15 @@ conf = {
     'date_end': '2022-06-24',  # End date if 'set_dates' is True
     'mode': 'image',  # image, html, or stitch (manual_path)
     'image_format': 'png',  # png or webp
+    'workers': 1,  # Number of processes rendering images in parallel (1 = render serially)
+    'render_engine': 'kaleido',  # kaleido (render each image with Plotly) or native (faster, composite from static layers)
+    # Batch of jobs rendered in one run (mode 'image'), each with settings overriding the ones below, e.g.
+    # {'metric': 'moving7d_pop', 'resolution': '10M', 'width': 1920, 'image_format': 'png'}
+    # Jobs are distributed to 'workers' processes. Empty list: single job using the settings below.
+    'jobs': [],
+    # Maximum size (MB) of the cache of images rendered by Kaleido (0 = no cache). Only helps when rendering
+    # the same data with the same settings again: new data changes the colors and date position of all frames.
+    'frame_cache_size': 0,
     'resolution': '10M',  # Resolution for the map: 01M, 03M, 10M, 60M
     'metric': 'moving14d_pop',  # Metric to use: see metric_desc
     'metric_desc': {  # Descriptions for the different metrics
@@ -20,7 +29,15 @@ conf = {
         'moving4w_pop': '4-week moving average of detected weekly cases per million by NUTS region',
         'moving8w_pop': '8-week moving average of detected weekly cases per million by NUTS region',
     },
+    # Format of mode 'html': compact (map once, frames as binary data), chunked (frames loaded from files
+    # with one chunk of dates each, for a static file server) or plotly (one trace per frame)
+    'html_format': 'compact',
+    'html_chunk': 'M',  # Dates per file of the frames for html_format 'chunked' (pandas period: M = month, W = week)
+    'html_encoding': 'float32',  # Values of the frames in compact HTML: float32 or uint8 (256 levels of the colorscale)
     'animation': True,  # Create animation? True or False (just for mode 'image')
+    'save_images': False,  # Also save each image as file when creating an animation? True/False
+    'resumable': False,  # Save images with a manifest, so an interrupted run can be resumed? True/False
+    'resume_path': '',  # Folder of images of an interrupted run to resume (e.g. 'export/image/20220624-101500')
     'animation_format': 'webp',  # File format of the animation (gif or webp). gif only works with png.
     'manual_path': '',  # Path for manual
     'animation_fps': 14,  # Frames per second
@@ -31,6 +48,7 @@ conf = {
     'zoom_adapt': 'height',  # Use height or width to adapt zoom?
     'colorscale': 'dataset',  # Set colorscale based on 'sample' or whole 'dataset'
     'coloraxis': False,  # Show color axis? True or False
+    'breaks_method': 'exact',  # Quantiles for the break points: exact or tdigest (estimated, for data too large to sort)
     'legend': True,  # Show legend based on calculated break points? True or False
     # 9 colors to be used to represent values
     'colors': [
@@ -46,10 +64,35 @@ conf = {
     ],
     # white-bg, open-street-map, carto-positron, carto-darkmatter, stamen-terrain, stamen-toner, stamen-watercolor
     'basemap': 'white-bg',
+    # Simplify the geometry of the maps saved as images: maximum deviation in pixels (0 to disable)
+    'geometry_tolerance': 0.25,
+    # Measures of each stage (wall time, CPU time, peak memory), printed and saved to export/profile/
+    'profile_memory': False,  # Also measure peak memory allocated by Python with tracemalloc (slower)? True/False
+    'profile_cprofile': False,  # Save cProfile statistics of each stage (export/profile/<datetime>/)? True/False
+    # Log each rendered frame (duration of each phase, frames per second, latency) to export/telemetry/? True/False
+    'telemetry_log': True,
+    # Folder for Prometheus textfiles updated with the metrics after each frame, one per job
+    # (e.g. the folder of the textfile collector of node_exporter), '' = disabled
+    'telemetry_textfile_path': '',
     # Settings for data update (including cleaning)
     'update_data': True,  # Re-run the script update_data.py to refresh data? True/False
     'limit_dates': False,  # Limit the dates to be included? True/False
     'data_start': '2020-02-01',  # Start date in case of True
     'data_end': '2022-06-24',  # End date in case of True
     'refresh_source': True,  # Download data to refresh? True/False
+    # COVID19-European-Regional-Tracker, only downloaded if it changed since the last download
+    'source_url': 'https://raw.githubusercontent.com/asjadnaqvi/COVID19-European-Regional-Tracker/master/04_master'
+    '/csv_nuts/EUROPE_COVID19_master.csv',
+    'source_file': 'data/european-regional-tracker.csv',
+    'update_incremental': False,  # Only recalculate data depending on new or changed source data? True/False
+    # Types of the data: compact (categories for names, float32 for values) or untyped (text and float64,
+    # needs about twice the memory)
+    'data_schema': 'compact',
+    'data_format': 'feather',  # Format of prepared data to import for plotting: feather, parquet or csv (CSV always exported)
+    # Remove extreme outliers: values more than outlier_sigma standard deviations from the mean of a centered
+    # rolling window (outlier_window days, at least outlier_min_periods values) and above outlier_min_cases
+    'outlier_window': 120,
+    'outlier_min_periods': 15,
+    'outlier_sigma': 5,
+    'outlier_min_cases': 100,
 }